@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+Checks that rendered tracker notes follow the structures they came from,
+counting every value and the spacing between events Channel by Channel
+Rows are read in large blocks that are split into cells by struct, and
+only whole cells are counted, so most of the work happens inside str,
+struct, and itertools instead of Python loops over every field
+"""
+
+import os
+import re
+import json
+import array
+import struct
+import operator
+import itertools
+import collections
+
+import merge
+import sinks
+import tracker
+import compiled
+import importer
+import structures
+import userinput as ui
+
+# (name, start, width) of every field of a cell, after its | divider
+FIELDS = (("pitch", 1, 3), ("instrument", 4, 2), ("volume", 6, 3),
+        ("effect", 9, 3))
+# fields the spacing between events is measured for
+EVENTS = ("pitch", "volume", "effect")
+# struct format of a cell, skipping its divider
+CELL_LAYOUT = "x%ss" % (importer.CELL_WIDTH - 1)
+BLOCK_ROWS = 65536
+# fields and spacings with at most this many distinct values in a block are
+# counted with str.count or list.count, which is much faster than counting
+# them one at a time
+FEW_VALUES = 32
+# str.translate table turning blanks into 0 and anything else into 1
+FILLED = "".join("\x00" if chr(code) in ". " else "\x01"
+                for code in xrange(256))
+# how many of the most common values are shown per field
+SHOWN = 5
+# shard and pattern files are named like song_001_p002.txt
+PART_NAME = re.compile(r"^(.*?)(_\d{3})?(_p\d{3})?$")
+
+
+class ChannelStats(object):
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.rows = 0
+        # Counter of whole cells, without their dividers
+        self.cells = collections.Counter()
+        # field -> Counter of rows between its events
+        self.gaps = dict((name, collections.Counter()) for name in EVENTS)
+        # field -> row of its last event
+        self.last = {}
+
+    def __str__(self):
+        parts = []
+        for name in EVENTS:
+            events = sum(self.values(name).values())
+            parts.append("%s %s event%s" % (events, name,
+                structures.plural(events)))
+        return "Channel %s: %s rows, %s." % (self.channel + 1, self.rows,
+            ", ".join(parts))
+
+    def values(self, name):
+        """Get the Counter of the values of a field, without blanks"""
+        start, width = [(start, width) for field, start, width in FIELDS
+                        if field == name][0]
+        counts = collections.Counter()
+        for cell, count in self.cells.items():
+            value = cell[start - 1:start - 1 + width]
+            if value.strip(". "):
+                counts[value] += count
+        return counts
+
+
+def count_values(values, counts):
+    """
+    Add how often every string in values appears to a Counter
+    If there are few distinct values, each is counted with one str.count
+    over all of them
+    """
+    distinct = set(values)
+    if (len(distinct) > FEW_VALUES or
+            any("\t" in value or "\n" in value for value in distinct)):
+        counts.update(values)
+        return None
+    joined = "\t" + "\n\t".join(values) + "\n"
+    for value in distinct:
+        counts[value] += joined.count("\t%s\n" % value)
+
+
+def count_gaps(gaps, counts):
+    """Add how often every number in gaps appears to a Counter"""
+    distinct = set(gaps)
+    if len(distinct) <= FEW_VALUES:
+        for gap in distinct:
+            counts[gap] += gaps.count(gap)
+    else:
+        counts.update(gaps)
+
+
+def add_block(stats, block, firstRow):
+    """Count the fields and event spacing of a block of rows"""
+    width = max(len(row) for row in block)
+    block = [row.ljust(width, ".") for row in block]
+    layout = struct.Struct(CELL_LAYOUT * len(stats) +
+        "%sx" % (width - len(stats) * importer.CELL_WIDTH))
+    # the cells of every Channel, as a tuple of them in each row
+    cells = zip(*map(layout.unpack, block))
+    text = "".join(block)
+    for column, channelStats in enumerate(stats):
+        cell = column * importer.CELL_WIDTH
+        channelStats.rows += len(block)
+        count_values(cells[column], channelStats.cells)
+        for name, start, length in FIELDS:
+            if name not in channelStats.gaps:
+                continue
+            filled = bytearray(text[cell + start::width].translate(FILLED))
+            rows = array.array("l", itertools.compress(
+                xrange(firstRow, firstRow + len(block)), filled))
+            if not rows:
+                continue
+            last = channelStats.last.get(name)
+            if last is not None:
+                channelStats.gaps[name][rows[0] - last] += 1
+            count_gaps(map(operator.sub, rows[1:], rows[:-1]),
+                channelStats.gaps[name])
+            channelStats.last[name] = rows[-1]
+
+
+def analyze_rows(rows, first=0):
+    """
+    Count the values and event spacing of every Channel in rows of
+    tracker notes, where the first column is the Channel at position first
+    Return a list of ChannelStats
+    """
+    stats = []
+    rows = iter(rows)
+    firstRow = 0
+    while True:
+        block = list(itertools.islice(rows, BLOCK_ROWS))
+        if not block:
+            break
+        channels = max(len(row) for row in block) // importer.CELL_WIDTH
+        while len(stats) < channels:
+            stats.append(ChannelStats(first + len(stats)))
+        add_block(stats, block, firstRow)
+        firstRow += len(block)
+    return stats
+
+
+def instrument_text(number):
+    """Format an Instrument number the way it's rendered"""
+    return "%s%s" % ("0123456789:;<=>?@ABCDEFGHI"[number // 10], number % 10)
+
+
+def candidates(plan, table, field):
+    """Get the candidate rows listed at field of a row in a plan table"""
+    start, count = table[field], table[field + 1]
+    return plan.candidates[start:start + count]
+
+
+def add_ranges(plan, table, rows, ranges):
+    """
+    Add the letters and value ranges of the rows of Volumes or Effects
+    in a plan table to ranges
+    """
+    source = plan.volumes if table == "volumes" else plan.effects
+    for row in rows:
+        letter, low, high = source[row * compiled.EFFECT_STRIDE:
+            (row + 1) * compiled.EFFECT_STRIDE]
+        ranges.setdefault(tracker.format_letter(letter), []).append(
+            (low, high))
+
+
+def channel_limits(plan, channel):
+    """Get every value the Channel at row channel of plan can render"""
+    row = channel * compiled.CHANNEL_STRIDE
+    limits = {"instrument": set(), "pitch": set(), "volume": {},
+        "effect": {}, "sampleArea": set([0]), "always": True}
+    for instrument in candidates(plan, plan.channels,
+                                row + compiled.INSTRUMENTS):
+        instrumentRow = instrument * compiled.INSTRUMENT_STRIDE
+        limits["instrument"].add(instrument_text(
+            plan.instruments[instrumentRow + compiled.NUMBER]))
+        octaves = candidates(plan, plan.instruments,
+            instrumentRow + compiled.OCTAVES)
+        # without Octaves an Instrument can be chosen and leave no note
+        if not octaves:
+            limits["always"] = False
+        for octave in octaves:
+            start, count = plan.octaves[octave * compiled.OCTAVE_STRIDE:
+                (octave + 1) * compiled.OCTAVE_STRIDE]
+            for pitch in xrange(start, start + count):
+                limits["pitch"].add(plan.pitches[pitch * compiled.PITCH_WIDTH:
+                    (pitch + 1) * compiled.PITCH_WIDTH])
+        add_ranges(plan, "volumes", candidates(plan, plan.instruments,
+            instrumentRow + compiled.INSTRUMENT_VOLUMES), limits["volume"])
+        for offset in candidates(plan, plan.instruments,
+                                instrumentRow + compiled.OFFSETS):
+            low, high, lowSA, highSA = plan.offsets[
+                offset * compiled.OFFSET_STRIDE:
+                (offset + 1) * compiled.OFFSET_STRIDE]
+            limits["sampleArea"].update(xrange(lowSA, highSA + 1))
+            # values are only limited at the ends of the Sample Areas
+            if lowSA == highSA:
+                ranges = [(low, high)]
+            else:
+                ranges = [(low, 255), (0, high)]
+                if highSA - lowSA > 1:
+                    ranges.append((0, 255))
+            limits["effect"].setdefault("O", []).extend(ranges)
+    add_ranges(plan, "volumes", candidates(plan, plan.channels,
+        row + compiled.VOLUMES), limits["volume"])
+    add_ranges(plan, "effects", candidates(plan, plan.channels,
+        row + compiled.EFFECTS), limits["effect"])
+    field = row + compiled.INSTRUMENTS
+    limits["spacing"] = tuple(plan.channels[field + 2:field + 4])
+    return limits
+
+
+def in_ranges(text, ranges, base):
+    """Check if text is a number in base within any of ranges"""
+    try:
+        value = int(text, base)
+    except ValueError:
+        return False
+    return any(low <= value <= high for low, high in ranges)
+
+
+def check_value(name, value, limits):
+    """Check if a rendered value of a field is allowed by limits"""
+    if name in ("pitch", "instrument"):
+        return value in limits[name]
+    elif name == "volume":
+        return in_ranges(value[1:], limits["volume"].get(value[0], []), 10)
+    if in_ranges(value[1:], limits["effect"].get(value[0], []), 16):
+        return True
+    # Sample Area changes share the effect column
+    return value[:2] == "SA" and in_ranges(value[2:],
+        [(area, area) for area in limits["sampleArea"]], 16)
+
+
+def find_problems(plan, stats):
+    """
+    Compare stats against the structures of the Channels in plan
+    Return a list of (channel, field, value, count) for every value or
+    note spacing that the Channel shouldn't be able to render
+    """
+    problems = []
+    for channelStats in stats:
+        if channelStats.channel >= plan.channel_count():
+            problems.append((channelStats.channel, "channel",
+                "not in the database", channelStats.rows))
+            continue
+        limits = channel_limits(plan, channelStats.channel)
+        for name, start, width in FIELDS:
+            for value, count in sorted(channelStats.values(name).items()):
+                if not check_value(name, value, limits):
+                    problems.append((channelStats.channel, name, value,
+                        count))
+        # notes come exactly one Instrument spacing apart, unless an
+        # Instrument without Octaves was chosen in between
+        low, high = limits["spacing"]
+        for gap, count in sorted(channelStats.gaps["pitch"].items()):
+            if gap < low + 1 or (limits["always"] and gap > high + 1):
+                problems.append((channelStats.channel, "note spacing",
+                    gap, count))
+    return problems
+
+
+def first_channel(filename):
+    """
+    Get the position of the first Channel in a rendered file, looking it
+    up in the index file written alongside it if it's a shard or pattern
+    Return None if it's named like one but no index lists it, as it could
+    just as well be a whole render with a number in its name
+    """
+    directory, name = os.path.split(filename)
+    match = PART_NAME.match(sinks.split_name(name)[0])
+    if not match.group(2) and not match.group(3):
+        return 0
+    indexName = os.path.join(directory, match.group(1) + ".index")
+    if not os.path.isfile(indexName):
+        return None
+    try:
+        with open(indexName, 'r') as infile:
+            index = json.load(infile)
+        # the index lists files as they were written, from wherever
+        # the production ran, so only their names are compared
+        for shard in index["shards"]:
+            if name in [os.path.basename(pattern)
+                        for pattern in shard["patterns"]]:
+                return shard["firstChannel"]
+    except (ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def show_counts(counts):
+    """Format the most common values of a Counter"""
+    return ", ".join("%s x%s" % (value, count)
+                    for value, count in counts.most_common(SHOWN))
+
+
+def analyze(database):
+    """Let the user check a rendered file against the database"""
+
+    filename = ui.get_filename(
+        "Enter the name of the rendered file to analyze.", 'r')
+    if not filename:
+        return None
+    first = first_channel(filename)
+    if first is None:
+        print("\n\"%s\" is named like a shard or pattern file, but no index "
+            "file next to it lists it, so it's analyzed as if it starts "
+            "from Channel 1." % filename)
+        first = 0
+    try:
+        with merge.open_pattern(filename) as pattern:
+            stats = analyze_rows(merge.read_rows(pattern), first)
+    except ValueError as error:
+        print("\nCould not analyze \"%s\". %s" % (filename, error))
+        return None
+
+    print("\nAnalyzed %s Channels of \"%s\", starting from Channel %s." % (
+        len(stats), filename, first + 1))
+    for channelStats in stats:
+        print("\n%s" % channelStats)
+        for name, start, width in FIELDS:
+            counts = channelStats.values(name)
+            if counts:
+                print("  %s: %s" % (name, show_counts(counts)))
+        for name in EVENTS:
+            if channelStats.gaps[name]:
+                print("  rows between %s events: %s" % (name,
+                    show_counts(channelStats.gaps[name])))
+
+    problems = find_problems(compiled.cache.get(database), stats)
+    if not problems:
+        print("\nEvery value is within the ranges of the database.")
+    for channel, name, value, count in problems:
+        print("Channel %s rendered %s %s %s time%s, which its structures "
+            "don't allow." % (channel + 1, name, value, count,
+                structures.plural(count)))
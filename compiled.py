@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+"""
+Compiles a database into flat tables of everything a production needs,
+so rendering never walks the structure graph or its lists of links
+"""
+
+import array
+import hashlib
+from multiprocessing import sharedctypes
+
+# every row of Plan.channels holds whether it's muted and overwriting,
+# then (candidate start, candidate count, low spacing, high spacing)
+# for its Instruments, Volumes, and Effects, in that order
+CHANNEL_STRIDE = 14
+MUTED, OVERWRITE = 0, 1
+INSTRUMENTS, VOLUMES, EFFECTS = 2, 6, 10
+CHILD_WIDTH = 4
+# every row of Plan.instruments holds its number, then (candidate start,
+# candidate count) for its Octaves, Volumes, and Offsets, in that order
+INSTRUMENT_STRIDE = 7
+NUMBER, OCTAVES, INSTRUMENT_VOLUMES, OFFSETS = 0, 1, 3, 5
+# Plan.octaves rows are (pitch start, pitch count) in Plan.pitches
+OCTAVE_STRIDE = 2
+# Plan.volumes and Plan.effects rows are (letter, low value, high value)
+EFFECT_STRIDE = 3
+# Plan.offsets rows are (low value, high value, low SA, high SA)
+OFFSET_STRIDE = 4
+# every pitch in Plan.pitches is a note and octave, like C-5
+PITCH_WIDTH = 3
+# the names of every table of numbers in a Plan
+TABLES = ("channels", "instruments", "octaves", "volumes", "effects",
+        "offsets", "candidates")
+# Plan table and row width of every child structure type
+CHILD_TABLES = {"Instruments": ("instruments", INSTRUMENT_STRIDE),
+                "Octaves": ("octaves", OCTAVE_STRIDE),
+                "Volumes": ("volumes", EFFECT_STRIDE),
+                "Effects": ("effects", EFFECT_STRIDE),
+                "Offsets": ("offsets", OFFSET_STRIDE)}
+# a cached Plan is compiled from scratch once its candidates grow this many
+# times past their size after the last full compile, plus some slack so
+# small Plans aren't rebuilt all the time, as rows left behind by edits
+# are never reused
+REBUILD_GROWTH = 4
+REBUILD_SLACK = 1024
+
+
+class Plan(object):
+
+    def __init__(self):
+        for table in TABLES:
+            setattr(self, table, array.array("l"))
+        self.pitches = ""
+
+    def __str__(self):
+        return "Plan of %s Channels using %s Instruments." % (
+            self.channel_count(), len(self.instruments) // INSTRUMENT_STRIDE)
+
+    def channel_count(self):
+        """Return how many Channels were compiled into the Plan"""
+        return len(self.channels) // CHANNEL_STRIDE
+
+
+class ChannelState(object):
+    """Everything about a Channel that changes while it's being rendered"""
+
+    def __init__(self, plan, channel, rng):
+        # the row of the Channel in its Plan
+        self.channel = channel
+        self.rng = rng
+        self.muted = bool(plan.channels[channel * CHANNEL_STRIDE + MUTED])
+        self.overwrite = bool(
+            plan.channels[channel * CHANNEL_STRIDE + OVERWRITE])
+        # rows left before the next Instrument, Volume, and Effect
+        self.spacing = [0, 0, 0]
+        # stores a tuple of instrument data during production
+        self.nextInstrument = None
+        # keeps track of changing the SA for Instrument Offsets
+        self.currentSA = 0
+        self.nextSA = 0
+        # position in a Markov model, if that engine is producing
+        self.chain = None
+
+
+class Compiler(object):
+    """Builds a Plan, giving every structure a row the first time it's seen"""
+
+    def __init__(self, database):
+        self.plan = Plan()
+        self.globalDB = database["global"]
+        # id -> (structure, type, row), keeping the structure so its id
+        # can't be reused by a new one while the Compiler is around
+        self.rows = {}
+        self.slices = {}
+        self.pitchRows = {}
+        # id -> (Channel, its row of numbers in Plan.channels)
+        self.channelValues = {}
+
+    def candidates(self, children, structType):
+        """
+        Store everything a child dict can choose from, in the same order
+        as the Channel or Instrument would have them, and return the
+        (start, count) of them in Plan.candidates
+        Identical candidate lists are only stored once
+        """
+        possible = list(children["local"])
+        if children["useglobal"]:
+            found = set(id(child) for child in possible)
+            for child in self.globalDB[structType]:
+                if id(child) not in found:
+                    found.add(id(child))
+                    possible.append(child)
+        rows = tuple(self.row(child, structType) for child in possible)
+        if rows not in self.slices:
+            self.slices[rows] = (len(self.plan.candidates), len(rows))
+            self.plan.candidates.extend(rows)
+        return self.slices[rows]
+
+    def values(self, structure, structType):
+        """Get the numbers a child structure is compiled into"""
+        if structType == "Instruments":
+            values = [structure.number]
+            for childType in ("Octaves", "Volumes", "Offsets"):
+                values.extend(self.candidates(
+                    structure.children()[childType], childType))
+        elif structType == "Octaves":
+            pitches = "".join("%s%s" % (pitch, structure.number)
+                            for pitch in structure.pitches)
+            if pitches not in self.pitchRows:
+                self.pitchRows[pitches] = (len(self.plan.pitches) //
+                    PITCH_WIDTH)
+                self.plan.pitches += pitches
+            values = [self.pitchRows[pitches], len(structure.pitches)]
+        elif structType in ("Volumes", "Effects"):
+            # an Effect that was never given a letter is stored as 0
+            letter = ord(structure.effect) if structure.effect else 0
+            values = [letter] + list(structure.valueRange)
+        elif structType == "Offsets":
+            values = list(structure.valueRange) + list(structure.sampleArea)
+        return values
+
+    def row(self, structure, structType):
+        """Return the row of a child structure, compiling it if it's new"""
+        key = id(structure)
+        if key not in self.rows:
+            # children are compiled first, so they never share its table
+            values = self.values(structure, structType)
+            table, stride = CHILD_TABLES[structType]
+            table = getattr(self.plan, table)
+            self.rows[key] = (structure, structType, len(table) // stride)
+            table.extend(values)
+        return self.rows[key][2]
+
+    def channel_values(self, channel):
+        """Get the row of numbers a Channel is compiled into"""
+        values = [int(channel.muted), int(channel.overwrite)]
+        children = channel.children()
+        for childType in ("Instruments", "Volumes", "Effects"):
+            values.extend(self.candidates(children[childType], childType))
+            values.extend(children[childType]["spacing"])
+        return values
+
+    def add_channel(self, channel):
+        """Compile a Channel into the next row of Plan.channels"""
+        key = id(channel)
+        if key not in self.channelValues:
+            self.channelValues[key] = (channel, self.channel_values(channel))
+        self.plan.channels.extend(self.channelValues[key][1])
+
+    def refresh(self, structure):
+        """
+        Compile a structure that was already compiled again, writing over
+        its old row so everything pointing to it sees the change
+        """
+        key = id(structure)
+        if key in self.channelValues:
+            self.channelValues[key] = (structure,
+                self.channel_values(structure))
+        elif key in self.rows:
+            structure, structType, row = self.rows[key]
+            table, stride = CHILD_TABLES[structType]
+            getattr(self.plan, table)[row * stride:(row + 1) * stride] = (
+                array.array("l", self.values(structure, structType)))
+
+    def using_globals(self, structTypes):
+        """Get every compiled structure that uses globals of structTypes"""
+        compiled = [structure for structure, values in
+                    self.channelValues.values()]
+        compiled += [structure for structure, structType, row in
+                    self.rows.values() if structType == "Instruments"]
+        return [structure for structure in compiled
+                if any(structure.children()[structType]["useglobal"]
+                       for structType in structTypes
+                       if structType in structure.children())]
+
+
+def compile_database(database):
+    """Compile every root Channel of a database into a Plan"""
+    compiler = Compiler(database)
+    for channel in database["root"]["Channels"]:
+        compiler.add_channel(channel)
+    return compiler.plan
+
+
+class PlanCache(object):
+    """
+    Keeps the Plan of the database between productions, compiling again
+    only the structures marked dirty by edits since it was last used
+    """
+
+    def __init__(self):
+        self.database = None
+        self.compiler = None
+        # id -> structure, for every structure edited since the last Plan
+        self.dirty = {}
+        # structure type -> tuple of the ids of its global structures
+        self.globalIds = {}
+        self.fullSize = 0
+
+    def __str__(self):
+        if self.compiler is None:
+            return "Nothing compiled yet."
+        return "%s %s dirty structures." % (self.compiler.plan,
+            len(self.dirty))
+
+    def mark(self, structure):
+        """Mark a structure as changed, so it's compiled again"""
+        self.dirty[id(structure)] = structure
+
+    def reset(self):
+        """Forget the cached Plan, for when the database is replaced"""
+        self.compiler = None
+        self.dirty.clear()
+
+    def get(self, database):
+        """Return the Plan of database, compiling only what changed"""
+        globalIds = dict((structType, tuple(id(structure)
+                          for structure in structList))
+                        for structType, structList in
+                        database["global"].items())
+        compiler = self.compiler
+        if (compiler is None or self.database is not database or
+                compiler.globalDB is not database["global"] or
+                len(compiler.plan.candidates) >
+                self.fullSize * REBUILD_GROWTH + REBUILD_SLACK):
+            compiler = Compiler(database)
+        else:
+            # adding or removing a global changes the candidates of
+            # everything that uses globals of its type
+            changed = [structType for structType in globalIds
+                       if globalIds[structType] !=
+                       self.globalIds.get(structType)]
+            if changed:
+                for structure in compiler.using_globals(changed):
+                    self.mark(structure)
+            for structure in self.dirty.values():
+                compiler.refresh(structure)
+            compiler.plan.channels = array.array("l")
+
+        for channel in database["root"]["Channels"]:
+            compiler.add_channel(channel)
+        if compiler is not self.compiler:
+            self.fullSize = len(compiler.plan.candidates)
+        self.database = database
+        self.compiler = compiler
+        self.globalIds = globalIds
+        self.dirty.clear()
+        return compiler.plan
+
+
+# the Plan of the database being edited
+cache = PlanCache()
+
+
+def channel_digest(database, channel):
+    """
+    Hash everything that decides what a Channel renders, in the order it
+    draws from them, so Channels with the same digest render the same
+    notes at the same position with the same seed
+    """
+    compiler = Compiler(database)
+    compiler.add_channel(channel)
+    return plan_digest(compiler.plan)
+
+
+def candidates_content(plan, structType, start, count, memo):
+    """
+    Get a hash of the content of every candidate of structType listed at
+    (start, count) in Plan.candidates, in order, remembering it in memo
+    """
+    key = (structType, start, count)
+    if key not in memo:
+        content = [row_content(plan, structType, row, memo)
+                   for row in plan.candidates[start:start + count]]
+        memo[key] = hashlib.sha1(repr(content)).hexdigest()
+    return memo[key]
+
+
+def row_content(plan, structType, row, memo):
+    """Get the content of the row of a child structure in a Plan"""
+    table, stride = CHILD_TABLES[structType]
+    values = getattr(plan, table)[row * stride:(row + 1) * stride]
+    if structType == "Instruments":
+        return (values[NUMBER],) + tuple(
+            candidates_content(plan, childType, values[field],
+                values[field + 1], memo)
+            for childType, field in (("Octaves", OCTAVES),
+                ("Volumes", INSTRUMENT_VOLUMES), ("Offsets", OFFSETS)))
+    elif structType == "Octaves":
+        start, count = values
+        return plan.pitches[start * PITCH_WIDTH:(start + count) * PITCH_WIDTH]
+    return tuple(values)
+
+
+def plan_digest(plan):
+    """
+    Hash what every Channel of a Plan draws from, in the order it draws,
+    so Plans with the same digest render the same notes with the same seed
+    Rows are hashed by content, so rows left behind by edits to a cached
+    Plan, or the order rows were compiled in, don't change the digest
+    """
+    memo = {}
+    content = []
+    for channel in xrange(plan.channel_count()):
+        row = plan.channels[channel * CHANNEL_STRIDE:
+            (channel + 1) * CHANNEL_STRIDE]
+        content.append((row[MUTED], row[OVERWRITE]) + tuple(
+            (candidates_content(plan, childType, row[field],
+                row[field + 1], memo), row[field + 2], row[field + 3])
+            for childType, field in (("Instruments", INSTRUMENTS),
+                ("Volumes", VOLUMES), ("Effects", EFFECTS))))
+    return hashlib.sha1(repr(content)).hexdigest()
+
+
+def share(plan):
+    """
+    Copy the tables of a Plan into shared memory, returning a Plan that
+    worker processes can read from without each holding their own copy
+    """
+    shared = Plan()
+    for table in TABLES:
+        values = getattr(plan, table)
+        setattr(shared, table, sharedctypes.RawArray("l", values))
+    shared.pitches = sharedctypes.RawArray("c", plan.pitches)
+    return shared
@@ -5,14 +5,27 @@ from __future__ import print_function
 """Handles parsing and correction of config file for the program"""
 
 import ConfigParser
+import multiprocessing
+
+# the most any shared render box will allow, whatever the config file says
+MAX_WORKERS = 32
+MAX_ROW_BLOCK = 1024
+MAX_QUEUE_DEPTH = 64
+MAX_MEMORY = 8192
+MAX_CACHE = 65536
+# random number generators Channels can be seeded with
+RNG_BACKENDS = ("mersenne", "wichmann")
+ENGINES = ("random", "markov")
 
 
 def check_boolean(section, variable, value, default=False):
     """Check that a config variable is a proper boolean"""
-    if value in (0, 1, "True", "False"):
-        return bool(value)
+    if value in (1, "1", "True"):
+        return True
+    elif value in (0, "0", "False"):
+        return False
     else:
-        print("Boolean value (0/True or 1/False) was expected in "
+        print("Boolean value (1/True or 0/False) was expected in "
             "%s %s but %s was found." % (section, variable, value))
         return default
 
@@ -27,6 +40,68 @@ def check_integer(section, variable, value):
         return 0
 
 
+def worker_count(workers):
+    """
+    Get how many worker processes to use, where 0 means one per CPU,
+    never going over MAX_WORKERS either way
+    """
+    return min(workers or multiprocessing.cpu_count(), MAX_WORKERS)
+
+
+def check_limit(section, variable, value, low, high):
+    """Check that a config variable is an integer within low and high"""
+    number = check_integer(section, variable, value)
+    if not low <= number <= high:
+        print("%s %s must be within %s and %s, but %s was found." % (
+            section, variable, low, high, number))
+        number = min(max(number, low), high)
+    return number
+
+
+def check_choice(section, variable, value, choices, default):
+    """Check that a config variable is one of a tuple of choices"""
+    value = value.lower()
+    if value in choices:
+        return value
+    print("%s was expected in %s %s but %s was found." % (
+        " or ".join(choices), section, variable, value))
+    return default
+
+
+def init_performance(config, production):
+    """
+    Read the optional Performance section into production, where its
+    settings replace the matching Production and Cache ones
+    Every setting is capped, so no config file can make a production
+    use more than a shared render box allows
+    """
+    performance = {"workers": str(production["workers"]),
+        "rowblock": "64", "queuedepth": "8", "rng": "mersenne",
+        "engine": production["engine"], "memory": "1024",
+        "cachesize": str(production["cache"]["size"])}
+    if config.has_section("Performance"):
+        performance.update(config.items("Performance"))
+
+    # 0 workers still means one per CPU, up to the cap
+    production["workers"] = check_limit("Performance", "workers",
+        performance["workers"], 0, MAX_WORKERS)
+    # rows are generated and written in blocks of this many rows,
+    # with up to queuedepth blocks waiting for the writer
+    production["rowblock"] = check_limit("Performance", "rowblock",
+        performance["rowblock"], 1, MAX_ROW_BLOCK)
+    production["queuedepth"] = check_limit("Performance", "queuedepth",
+        performance["queuedepth"], 1, MAX_QUEUE_DEPTH)
+    production["rng"] = check_choice("Performance", "rng",
+        performance["rng"], RNG_BACKENDS, "mersenne")
+    production["engine"] = check_choice("Performance", "engine",
+        performance["engine"], ENGINES, "random")
+    # the memory ceiling in MB for buffered rows across every worker
+    production["memory"] = check_limit("Performance", "memory",
+        performance["memory"], 1, MAX_MEMORY)
+    production["cache"]["size"] = check_limit("Performance", "cachesize",
+        performance["cachesize"], 0, MAX_CACHE)
+
+
 def init_config_file():
     """Opens a config file to parse through it and returns it"""
 
@@ -41,9 +116,42 @@ def init_config_file():
         production["overwrite"])
     production["lines"] = check_integer("Production", "lines",
         production["lines"])
+    # a blank seed means a fresh one is picked for every production
+    if production.get("seed"):
+        production["seed"] = check_integer("Production", "seed",
+            production["seed"])
+    else:
+        production["seed"] = None
+    # 0 workers means one per CPU when producing shards
+    production["workers"] = check_integer("Production", "workers",
+        production.get("workers", "0"))
+    # 0 pattern rows means the song is written as one continuous block
+    production["patternrows"] = check_integer("Production", "patternrows",
+        production.get("patternrows", "0"))
+    if production["patternrows"] > 1024:
+        print("OpenMPT patterns can't be longer than 1024 rows, but "
+            "Production patternrows is %s." % production["patternrows"])
+        production["patternrows"] = 1024
+    # the Markov engine learns from the training pattern files
+    production["engine"] = check_choice("Production", "engine",
+        production.get("engine", "random"), ENGINES, "random")
+    production["training"] = production.get("training", "")
+    # renders get numbered names in this directory, if it's set
+    production["outputdir"] = production.get("outputdir", "")
+
+    # the render cache is optional, and a size of 0 MB turns it off
+    cache = {"location": ".render_cache", "size": "256"}
+    if config.has_section("Cache"):
+        cache.update(config.items("Cache"))
+    cache["size"] = check_integer("Cache", "size", cache["size"])
+    production["cache"] = cache
+    init_performance(config, production)
 
     dbConfig = dict(config.items("Database"))
     dbConfig["overwrite"] = check_boolean("Database", "overwrite",
             dbConfig["overwrite"])
+    # how many edits can be undone
+    dbConfig["history"] = check_integer("Database", "history",
+        dbConfig.get("history", "50"))
 
     return dbConfig, production
\ No newline at end of file
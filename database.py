@@ -7,7 +7,10 @@ from __future__ import print_function
 import os
 import copy
 import pickle
+import threading
 
+import compiled
+import history
 import interface
 import structures
 import userinput as ui
@@ -23,10 +26,43 @@ def init(dbConfig=None):
     del database["global"]["Channels"]
     if dbConfig is not None and dbConfig["load"]:
         print("Trying to load database from file \"%s\"." % dbConfig["load"])
-        load(database, dbConfig["load"], "init")
+        # loading at startup should never stop to prompt the user
+        if os.path.isfile(dbConfig["load"]):
+            load(database, dbConfig["load"], "init")
+        else:
+            print("\"%s\" cannot be loaded as it doesn't exist." %
+                dbConfig["load"])
     return database
 
 
+class Preload(object):
+    """Initializes a database on a background thread"""
+
+    def __init__(self, dbConfig=None):
+        self.database = None
+        self.ready = threading.Event()
+        thread = threading.Thread(target=self.run, args=(dbConfig,))
+        thread.daemon = True
+        thread.start()
+
+    def run(self, dbConfig):
+        """Initialize the database, falling back to an empty one"""
+        try:
+            self.database = init(dbConfig)
+        except Exception as error:
+            print("\nCould not load the database. %s" % error)
+            self.database = init()
+        finally:
+            self.ready.set()
+
+    def result(self):
+        """Return the database, waiting for it to finish loading if needed"""
+        if not self.ready.is_set():
+            print("\nWaiting for the database to finish loading.")
+            self.ready.wait()
+        return self.database
+
+
 def add_to(database, curDB, structType):
     """Let the user add a structure to a database"""
 
@@ -42,7 +78,7 @@ def add_to(database, curDB, structType):
     else:
         new = functions[structType]()
 
-    database[curDB][structType].append(new)
+    history.insert(database[curDB][structType], new)
 
 
 def delete_from(database, curDB, structType):
@@ -54,7 +90,7 @@ def delete_from(database, curDB, structType):
 
     for structure in toDelete:
         interface.remove_all_links(structure)
-        database[curDB][structType].remove(structure)
+        history.remove(database[curDB][structType], structure)
 
     deleted = len(toDelete)
     msg = "\nDeleted %s %s" % (deleted, curDB)
@@ -65,6 +101,40 @@ def delete_from(database, curDB, structType):
     print(msg)
 
 
+def copy_structures(database, curDB, structType):
+    """Let the user copy structures, optionally with all their children"""
+
+    prompt = "Choose %s %s to copy. Press C to continue." % (
+        curDB, structType)
+    toCopy = ui.make_mult_choice(prompt, database[curDB][structType], "C")
+    if not toCopy:
+        print("\nNothing was copied.")
+        return None
+
+    deep = False
+    if structType in ("Channels", "Instruments"):
+        deep = ui.get_binary_choice(
+            "Copy the structures they use as well? Y/N")
+
+    clones = {}
+    for structure in toCopy:
+        history.insert(database[curDB][structType],
+            interface.clone_structure(structure, clones, deep))
+
+    copied = len(clones)
+    if deep and copied > len(toCopy):
+        # cloned children go next to their originals
+        originals = set(clones) - set(id(structure) for structure in toCopy)
+        for dbName, structs in database.items():
+            for key, structList in structs.items():
+                for structure in list(structList):
+                    if id(structure) in originals:
+                        history.insert(structList, clones[id(structure)])
+                        originals.remove(id(structure))
+
+    print("\nCopied %s structure%s." % (copied, structures.plural(copied)))
+
+
 def view(database, curDB, structType):
     """Let the user page through part of the database"""
 
@@ -112,6 +182,8 @@ def edit(database, curDB, structType):
     prompt = "Choose a %s to edit." % structType[:-1]
     structure = ui.make_mult_choice(prompt, database[curDB][structType],
         single=True)
+    if structure is None:
+        return None
 
     if structType == "Channels":
         interface.edit_channel(database, structure)
@@ -130,14 +202,43 @@ def basic_actions(database, curDB, action, structType, dbToUse=""):
         print(msg % action)
         return None
     functions = {"add": add_to, "delete": delete_from,
-                "view": view, "edit": edit}
-    functions[action](database, curDB, structType)
+                "view": view, "edit": edit, "copy": copy_structures,
+                "move": arrange}
+    if action == "view":
+        functions[action](database, curDB, structType)
+        return None
+    history.begin("%s %s %s" % (action, curDB, structType))
+    try:
+        functions[action](database, curDB, structType)
+    finally:
+        history.commit()
+
 
+def arrange(database, curDB, structType):
+    """Let the user move structures between the root and global databases"""
 
-def arrange(database):
-    """Must be given the root database"""
+    if structType == "Channels":
+        print("\nChannels can't be moved, as there can't be global ones.")
+        return None
     prompt = "Do you want to move (T)o or (F)rom the global database?"
     valid = list("TF")
+    if ui.get_choice(prompt, valid) == "T":
+        source, target = "root", "global"
+    else:
+        source, target = "global", "root"
+
+    prompt = "Choose %s %s to move to the %s database. Press C to continue."
+    toMove = ui.make_mult_choice(prompt % (source, structType, target),
+        database[source][structType], "C")
+
+    # links are object references, so they survive the move untouched
+    moved = history.remove_many(database[source][structType],
+        set(id(structure) for structure in toMove))
+    for structure in moved:
+        history.insert(database[target][structType], structure)
+
+    print("\nMoved %s %s to the %s database." % (len(moved),
+        structType if len(moved) != 1 else structType[:-1], target))
 
 
 def save(database, dbConfig, filename="", overwrite=None):
@@ -154,12 +255,83 @@ def save(database, dbConfig, filename="", overwrite=None):
         print("\nNo file to save to.")
     else:
         # pickle seems to not work well unless I do this(!)
-        if filename in os.listdir("."):
+        if os.path.isfile(filename):
             os.remove(filename)
         with open(filename, 'w') as outfile:
             pickle.dump(database, outfile)
 
 
+def rewire(structure, replaced):
+    """
+    Point the links of a structure away from discarded duplicates
+    replaced maps the ids of discarded structures to their survivors
+    """
+    if hasattr(structure, "children"):
+        for children in structure.children().values():
+            local = []
+            found = set()
+            for child in children["local"]:
+                survivor = replaced.get(id(child), child)
+                if id(survivor) in found:
+                    continue
+                found.add(id(survivor))
+                local.append(survivor)
+                if survivor is not child:
+                    interface.get_used_by(survivor, structure).append(
+                        structure)
+            children["local"] = local
+
+    # drops links from discarded parents, as their survivors have their own
+    if type(structure) == structures.Volume:
+        for key, parents in structure.usedBy.items():
+            structure.usedBy[key] = [parent for parent in parents
+                                    if id(parent) not in replaced]
+    elif type(structure) != structures.Channel:
+        structure.usedBy = [parent for parent in structure.usedBy
+                            if id(parent) not in replaced]
+
+
+def append_database(database, newDatabase):
+    """
+    Append newDatabase to database, merging structures with identical
+    content into the copy database already has
+    Channels are always kept, as each one is its own track even when
+    it's set up just like another
+    Return how many duplicate structures were collapsed
+    """
+    digests = {}
+    survivors = {}
+    for curDB, structs in database.items():
+        for structType, structList in structs.items():
+            if structType == "Channels":
+                continue
+            for structure in structList:
+                key = (curDB, structures.content_hash(structure, digests))
+                survivors.setdefault(key, structure)
+
+    replaced = {}
+    kept = []
+    # children come first so their survivors are known to their parents
+    order = ("Octaves", "Effects", "Volumes", "Offsets",
+            "Instruments", "Channels")
+    for structType in order:
+        for curDB in ("root", "global"):
+            for structure in newDatabase[curDB].get(structType, []):
+                survivor = structure
+                if structType != "Channels":
+                    key = (curDB, structures.content_hash(structure, digests))
+                    survivor = survivors.setdefault(key, structure)
+                if survivor is structure:
+                    database[curDB][structType].append(structure)
+                    kept.append(structure)
+                else:
+                    replaced[id(structure)] = survivor
+
+    for structure in kept:
+        rewire(structure, replaced)
+    return len(replaced)
+
+
 def load(database, filename="", mode=""):
     """Load a file into or over the database"""
 
@@ -174,16 +346,17 @@ def load(database, filename="", mode=""):
         prompt = "Overwrite Database, or append to it?"
         mode = ui.get_choice(prompt, ["overwrite", "append"], "lower")
 
-    if mode == "init":
-        print("\nAutomatically appended database from \"%s\"." % filename)
-    elif mode == "overwrite":
+    if mode == "overwrite":
         print("\nOverwriting database with \"%s\"." % filename)
         database.update(newDatabase)
-    elif mode == "append":
-        print("\nAppending database with \"%s\"." % filename)
-        # only root DB gets Channels
-        database["root"]["Channels"] += newDatabase["root"]["Channels"]
-        structs = ("Instruments", "Octaves", "Effects", "Volumes", "Offsets")
-        for key in structs:
-            database["root"][key] += newDatabase["root"][key]
-            database["global"][key] += newDatabase["global"][key]
\ No newline at end of file
+        compiled.cache.reset()
+    else:
+        if mode == "init":
+            print("\nAutomatically appending database from \"%s\"." %
+                filename)
+        else:
+            print("\nAppending database with \"%s\"." % filename)
+        collapsed = append_database(database, newDatabase)
+        if collapsed:
+            print("Merged %s duplicate structure%s into existing ones." % (
+                collapsed, structures.plural(collapsed)))
\ No newline at end of file
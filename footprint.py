@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+Measures how much memory a database takes by walking its structures,
+counting each structure's own data once and its links separately
+"""
+
+import sys
+import time
+
+import structures
+
+STRUCTURE_TYPES = (structures.Channel, structures.Instrument,
+                structures.Octave, structures.Effect, structures.Offset)
+# how many of the largest Channels and Instruments are listed
+LARGEST_SHOWN = 5
+
+
+def own_size(value):
+    """
+    Get the bytes used by a value and everything it holds, stopping at
+    other structures, which only count as links
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, STRUCTURE_TYPES):
+        return size + own_size(vars(value))
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            size += sys.getsizeof(key)
+            if not isinstance(item, STRUCTURE_TYPES):
+                size += own_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            if not isinstance(item, STRUCTURE_TYPES):
+                size += own_size(item)
+    return size
+
+
+def get_children(database, structure):
+    """Get every child a Channel or Instrument can use, including globals"""
+    children = []
+    for structType, childDict in structure.children().items():
+        children += childDict["local"]
+        if childDict["useglobal"]:
+            children += database["global"][structType]
+    return children
+
+
+def used_by(structure):
+    """Get the list of parents of a child structure"""
+    if type(structure) == structures.Volume:
+        return structure.usedBy["Channels"] + structure.usedBy["Instruments"]
+    return structure.usedBy
+
+
+def reachable(database, structure, sizes, subgraphs):
+    """
+    Get the set of ids of every structure reachable from a structure,
+    including itself, remembering them in subgraphs
+    """
+    key = id(structure)
+    if key not in subgraphs:
+        found = set([key])
+        if hasattr(structure, "children"):
+            for child in get_children(database, structure):
+                sizes.setdefault(id(child), own_size(child))
+                found |= reachable(database, child, sizes, subgraphs)
+        subgraphs[key] = found
+    return subgraphs[key]
+
+
+def measure(database):
+    """
+    Measure a database, returning a dict with the bytes and count of
+    every structure type per database, the link and orphan counts, and
+    the largest Channels and Instruments by reachable subgraph
+    """
+    report = {"types": {}, "links": 0, "backlinks": 0, "orphans": {},
+            "largest": {}}
+    sizes = {}
+    subgraphs = {}
+    for curDB in ("root", "global"):
+        for structType, structList in sorted(database[curDB].items()):
+            total = 0
+            for structure in structList:
+                sizes.setdefault(id(structure), own_size(structure))
+                total += sizes[id(structure)]
+                if hasattr(structure, "children"):
+                    report["links"] += sum(len(children["local"])
+                        for children in structure.children().values())
+                if type(structure) != structures.Channel:
+                    parents = used_by(structure)
+                    report["backlinks"] += len(parents)
+                    if not parents:
+                        report["orphans"][structType] = report[
+                            "orphans"].get(structType, 0) + 1
+            report["types"][(curDB, structType)] = (total, len(structList))
+
+    for structType in ("Channels", "Instruments"):
+        ranked = []
+        for curDB in ("root", "global"):
+            for structure in database[curDB].get(structType, []):
+                ids = reachable(database, structure, sizes, subgraphs)
+                ranked.append((sum(sizes[key] for key in ids), len(ids),
+                    curDB, structure))
+        ranked.sort(key=lambda item: item[:2], reverse=True)
+        report["largest"][structType] = ranked[:LARGEST_SHOWN]
+    return report
+
+
+def show(database):
+    """Print a report of how much memory a database takes"""
+    started = time.time()
+    report = measure(database)
+
+    print("\nMemory used by the database:")
+    grandTotal = 0
+    for (curDB, structType), (size, count) in sorted(report["types"].items()):
+        grandTotal += size
+        print("%s %s: %s bytes in %s structure%s." % (curDB, structType,
+            size, count, structures.plural(count)))
+    print("Total: %s bytes." % grandTotal)
+    print("Links from parents to children: %s." % report["links"])
+    print("Links from children to parents: %s." % report["backlinks"])
+
+    orphans = report["orphans"]
+    if orphans:
+        print("Structures not used by anything: %s." % ", ".join(
+            "%s %s" % (count, structType)
+            for structType, count in sorted(orphans.items())))
+    else:
+        print("Every structure is used by something.")
+
+    for structType in ("Channels", "Instruments"):
+        largest = report["largest"][structType]
+        if not largest:
+            continue
+        print("\nLargest %s, with everything they can use:" % structType)
+        for size, count, curDB, structure in largest:
+            print("%s bytes in %s structures: %s %s" % (size, count, curDB,
+                str(structure).strip().splitlines()[0]))
+
+    print("\nMeasured in %.2f seconds." % (time.time() - started))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""
+Undo and redo for database edits
+Each edit only records the structures it touches, copied the first time
+they are touched, along with where structures were added or removed
+"""
+
+import collections
+
+import compiled
+
+# how many edits can be undone by default
+DEFAULT_LIMIT = 50
+
+undoStack = collections.deque(maxlen=DEFAULT_LIMIT)
+redoStack = []
+# the edit being recorded, if any
+current = None
+
+
+class Edit(object):
+
+    def __init__(self, description):
+        self.description = description
+        # id -> (structure, state before the edit)
+        self.states = collections.OrderedDict()
+        # (insert or remove, list, index, structure) in the order done
+        self.changes = []
+
+    def __str__(self):
+        return self.description
+
+
+def capture(structure):
+    """Copy the state of a structure deep enough to restore it later"""
+    state = {}
+    for name, value in vars(structure).items():
+        if isinstance(value, dict):
+            value = dict((key, list(item) if isinstance(item, list) else item)
+                        for key, item in value.items())
+        elif isinstance(value, list):
+            value = list(value)
+        state[name] = value
+    return state
+
+
+def swap_states(edit):
+    """Restore every state saved in edit, saving the replaced ones instead"""
+    for key, (structure, state) in edit.states.items():
+        compiled.cache.mark(structure)
+        edit.states[key] = (structure, capture(structure))
+        vars(structure).clear()
+        vars(structure).update(state)
+
+
+def set_limit(limit):
+    """Change how many edits are kept, dropping the oldest if needed"""
+    global undoStack
+    undoStack = collections.deque(undoStack, maxlen=limit)
+
+
+def clear():
+    """Forget every edit, for when the database is replaced"""
+    undoStack.clear()
+    del redoStack[:]
+
+
+def begin(description):
+    """Start recording an edit"""
+    global current
+    current = Edit(description)
+
+
+def commit():
+    """Finish recording an edit, keeping it if it changed anything"""
+    global current
+    if current is not None and (current.states or current.changes):
+        undoStack.append(current)
+        del redoStack[:]
+    current = None
+
+
+def touch(structure):
+    """Save the state of a structure before the current edit changes it"""
+    compiled.cache.mark(structure)
+    if current is not None and id(structure) not in current.states:
+        current.states[id(structure)] = (structure, capture(structure))
+
+
+def insert(structList, structure, index=None):
+    """Insert a structure into a database list as part of the current edit"""
+    if index is None:
+        index = len(structList)
+    structList.insert(index, structure)
+    if current is not None:
+        current.changes.append(("insert", structList, index, structure))
+
+
+def remove(structList, structure):
+    """Remove a structure from a database list as part of the current edit"""
+    index = structList.index(structure)
+    del structList[index]
+    if current is not None:
+        current.changes.append(("remove", structList, index, structure))
+
+
+def remove_many(structList, chosen):
+    """
+    Remove every structure whose id is in chosen from a database list in
+    a single pass, as part of the current edit
+    Return the removed structures
+    """
+    kept = []
+    removed = []
+    for index, structure in enumerate(structList):
+        if id(structure) in chosen:
+            removed.append((index, structure))
+        else:
+            kept.append(structure)
+    structList[:] = kept
+    if current is not None:
+        # later indexes first, as if they had been removed one at a time
+        for index, structure in reversed(removed):
+            current.changes.append(("remove", structList, index, structure))
+    return [structure for index, structure in removed]
+
+
+def undo():
+    """Undo the last edit, returning it, or None if there's nothing to undo"""
+    if not undoStack:
+        return None
+    edit = undoStack.pop()
+    swap_states(edit)
+    for action, structList, index, structure in reversed(edit.changes):
+        if action == "insert":
+            del structList[index]
+        else:
+            structList.insert(index, structure)
+    redoStack.append(edit)
+    return edit
+
+
+def redo():
+    """Redo the last undone edit, returning it, or None if there is none"""
+    if not redoStack:
+        return None
+    edit = redoStack.pop()
+    swap_states(edit)
+    for action, structList, index, structure in edit.changes:
+        if action == "insert":
+            structList.insert(index, structure)
+        else:
+            del structList[index]
+    undoStack.append(edit)
+    return edit
@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""Derives database structures from existing OpenMPT pattern files"""
+
+import json
+import glob
+import collections
+import multiprocessing
+
+import merge
+import config
+import history
+import interface
+import structures
+import userinput as ui
+
+# every Channel is a "|" followed by 11 fixed-width characters
+CELL_WIDTH = 12
+# structure types in the order they can be made, children first
+ORDER = ("Octaves", "Volumes", "Effects", "Offsets", "Instruments",
+        "Channels")
+# structure types that can link to children, and what those children are
+LINKS = {"Channels": ("Instruments", "Volumes", "Effects"),
+        "Instruments": ("Octaves", "Volumes", "Offsets")}
+
+
+def new_stats():
+    """Make an empty record of everything found in pattern files"""
+    return {"Instruments": {}, "Octaves": {}, "Volumes": {}, "Effects": {},
+            "Offsets": {"values": None, "areas": None}}
+
+
+def widen(valueRange, value):
+    """Return valueRange extended to include value"""
+    if valueRange is None:
+        return (value, value)
+    return (min(valueRange[0], value), max(valueRange[1], value))
+
+
+def parse_hex(value):
+    """Return value parsed as hex, or None if it isn't hex"""
+    try:
+        return int(value, 16)
+    except ValueError:
+        return None
+
+
+def parse_cell(stats, cell, sampleArea):
+    """
+    Record the contents of a single cell in stats
+    cell is the 11 characters after a "|", laid out as note (3),
+    instrument (2), volume (3) and effect (3)
+    Return the Sample Area in use after the cell
+    """
+    note, number = cell[0:3], cell[3:5]
+    volume, effect = cell[5:8], cell[8:11]
+
+    instrument = None
+    if number.isdigit() or (number[0] in ":;<=>?@ABCDEFGHI" and
+            number[1].isdigit()):
+        # tens past 9 continue up the ASCII table, as OpenMPT does
+        number = (ord(number[0]) - ord("0")) * 10 + int(number[1])
+        if 1 <= number <= 255:
+            instrument = stats["Instruments"].setdefault(number,
+                {"Octaves": set(), "Volumes": set(), "Offsets": False})
+
+    if note[:2] in structures.Octave.defaultPitches and note[2].isdigit():
+        octave = int(note[2])
+        stats["Octaves"].setdefault(octave, set()).add(note[:2])
+        if instrument is not None:
+            instrument["Octaves"].add(octave)
+
+    if volume[0] in "vpabcdefgh" and volume[1:].isdigit():
+        stats["Volumes"][volume[0]] = widen(
+            stats["Volumes"].get(volume[0]), int(volume[1:]))
+        if instrument is not None:
+            instrument["Volumes"].add(volume[0])
+
+    letter, value = effect[0], parse_hex(effect[1:])
+    if value is None:
+        pass
+    elif effect[:2] == "SA":
+        sampleArea = value & 0xF
+    elif letter == "O":
+        offsets = stats["Offsets"]
+        offsets["values"] = widen(offsets["values"], value)
+        offsets["areas"] = widen(offsets["areas"], sampleArea)
+        if instrument is not None:
+            instrument["Offsets"] = True
+    elif letter in "#\\ABCDEFGHIJKLMNPQRSTUVWXYZ":
+        stats["Effects"][letter] = widen(stats["Effects"].get(letter), value)
+
+    return sampleArea
+
+
+def parse_file(filename):
+    """
+    Stream a pattern file and return stats of everything in it
+    Files that aren't OpenMPT patterns return empty stats
+    """
+    stats = new_stats()
+    sampleAreas = []
+    with merge.open_pattern(filename) as mapped:
+        try:
+            for row in merge.read_rows(mapped):
+                columns = len(row) // CELL_WIDTH
+                if columns > len(sampleAreas):
+                    sampleAreas += [0] * (columns - len(sampleAreas))
+                for column in xrange(columns):
+                    start = column * CELL_WIDTH + 1
+                    sampleAreas[column] = parse_cell(stats,
+                        row[start:start + CELL_WIDTH - 1],
+                        sampleAreas[column])
+        except ValueError as error:
+            print("\nSkipped \"%s\". %s" % (filename, error))
+    return stats
+
+
+def merge_stats(stats, other):
+    """Combine the stats of other into stats"""
+    for number, found in other["Instruments"].items():
+        instrument = stats["Instruments"].setdefault(number,
+            {"Octaves": set(), "Volumes": set(), "Offsets": False})
+        instrument["Octaves"] |= found["Octaves"]
+        instrument["Volumes"] |= found["Volumes"]
+        instrument["Offsets"] = instrument["Offsets"] or found["Offsets"]
+    for number, pitches in other["Octaves"].items():
+        stats["Octaves"].setdefault(number, set()).update(pitches)
+    for key in ("Volumes", "Effects"):
+        for letter, valueRange in other[key].items():
+            for value in valueRange:
+                stats[key][letter] = widen(stats[key].get(letter), value)
+    for key in ("values", "areas"):
+        if other["Offsets"][key] is not None:
+            for value in other["Offsets"][key]:
+                stats["Offsets"][key] = widen(stats["Offsets"][key], value)
+
+
+def parse_files(filenames, workers=0):
+    """Parse many pattern files, across a pool of workers if worthwhile"""
+    stats = new_stats()
+    workers = min(config.worker_count(workers), len(filenames))
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.imap_unordered(parse_file, filenames)
+            for found in results:
+                merge_stats(stats, found)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for filename in filenames:
+            merge_stats(stats, parse_file(filename))
+    return stats
+
+
+def build_structures(stats):
+    """
+    Create linked structures from stats
+    Return a dict of lists of new structures keyed by structure type
+    """
+    built = {"Instruments": [], "Octaves": [], "Volumes": [],
+            "Effects": [], "Offsets": []}
+
+    octaves = {}
+    for number in sorted(stats["Octaves"]):
+        pitches = [pitch for pitch in structures.Octave.defaultPitches
+                    if pitch in stats["Octaves"][number]]
+        octaves[number] = structures.Octave(number, pitches)
+        built["Octaves"].append(octaves[number])
+
+    volumes = {}
+    for letter in sorted(stats["Volumes"]):
+        volumes[letter] = structures.Volume(letter, stats["Volumes"][letter])
+        built["Volumes"].append(volumes[letter])
+
+    for letter in sorted(stats["Effects"]):
+        built["Effects"].append(
+            structures.Effect(letter, stats["Effects"][letter]))
+
+    offset = None
+    if stats["Offsets"]["values"] is not None:
+        offset = structures.Offset(stats["Offsets"]["values"],
+            stats["Offsets"]["areas"])
+        built["Offsets"].append(offset)
+
+    for number in sorted(stats["Instruments"]):
+        found = stats["Instruments"][number]
+        instrument = structures.Instrument(number)
+        if found["Octaves"]:
+            interface.add_children_to_parent(instrument,
+                [octaves[n] for n in sorted(found["Octaves"])])
+        if found["Volumes"]:
+            interface.add_children_to_parent(instrument,
+                [volumes[letter] for letter in sorted(found["Volumes"])])
+        if found["Offsets"] and offset is not None:
+            interface.add_children_to_parent(instrument, [offset])
+        built["Instruments"].append(instrument)
+
+    return built
+
+
+def plain(value):
+    """
+    Turn the unicode strings json gives back into str, all the way down,
+    so imported structures hash the same as ones made through the prompts
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [plain(item) for item in value]
+    elif isinstance(value, dict):
+        return dict((plain(key), plain(item)) for key, item in value.items())
+    return value
+
+
+def is_whole(value):
+    """Check if a value is a whole number, and not a bool"""
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def is_id(value):
+    """Check if a value can be the id of a definition"""
+    return isinstance(value, str) or is_whole(value)
+
+
+def volume_high(effect):
+    """Get the highest value a Volume Command can have"""
+    return 64 if effect in ("v", "p") else 9
+
+
+def check_range(errors, where, valueRange, low, high):
+    """Check a value range is a pair of ints in order within low and high"""
+    if (not isinstance(valueRange, list) or len(valueRange) != 2 or
+            not all(is_whole(value) for value in valueRange)):
+        errors.append("%s must be a pair of whole numbers." % where)
+    elif not low <= valueRange[0] <= valueRange[1] <= high:
+        errors.append("%s must go from low to high within %s and %s." % (
+            where, low, high))
+
+
+def check_number(errors, where, value, low, high):
+    """Check a value is a whole number within low and high"""
+    if not is_whole(value) or not low <= value <= high:
+        errors.append("%s needs a number within %s and %s." % (
+            where, low, high))
+
+
+def check_letter(errors, where, effect, letters, name):
+    """Check a Volume Command or Effect Type is one of letters"""
+    if (not isinstance(effect, str) or len(effect) != 1 or
+            effect not in letters):
+        errors.append("%s needs %s." % (where, name))
+
+
+def check_children(errors, ids, where, structType, childType, children):
+    """Check the links a definition has to children of childType"""
+    if isinstance(children, list):
+        children = {"local": children}
+    if not isinstance(children, dict):
+        errors.append("%s %s must be a list or an object." % (where,
+            childType))
+        return None
+    local = children.get("local", [])
+    if not isinstance(local, list):
+        errors.append("%s %s local must be a list." % (where, childType))
+        local = []
+    for childId in local:
+        if not is_id(childId) or ids.get(childId) != childType:
+            errors.append("%s uses %s, which isn't a defined %s." % (
+                where, childId, childType[:-1]))
+    if not isinstance(children.get("useglobal", False), bool):
+        errors.append("%s %s useglobal must be true or false." % (where,
+            childType))
+    if structType == "Channels":
+        check_range(errors, "%s %s spacing" % (where, childType),
+            children.get("spacing", [0, 0]), 0, ui.INFINITY)
+
+
+def check_definition(errors, ids, structType, n, definition):
+    """
+    Check a single structure definition, using the same limits
+    as making that structure through the interface
+    """
+    if not isinstance(definition, dict):
+        errors.append("%s %s must be an object." % (structType[:-1], n + 1))
+        return None
+    where = "%s %s" % (structType[:-1], definition.get("id", n + 1))
+    if "id" in definition and not is_id(definition["id"]):
+        errors.append("%s needs an id that's text or a whole number." %
+            where)
+    database = definition.get("database", "root")
+    if database not in ("root", "global"):
+        errors.append("%s has an unknown database %s." % (where, database))
+    elif structType == "Channels" and database == "global":
+        errors.append("%s can't be global, as there can't be any global "
+            "Channels." % where)
+
+    if structType == "Channels":
+        for name in ("overwrite", "muted"):
+            if not isinstance(definition.get(name, False), bool):
+                errors.append("%s %s must be true or false." % (where, name))
+    elif structType == "Instruments":
+        check_number(errors, where, definition.get("number"), 1, 255)
+    elif structType == "Octaves":
+        check_number(errors, where, definition.get("number", 5), 0, 9)
+        pitches = definition.get("pitches",
+            structures.Octave.defaultPitches)
+        if not isinstance(pitches, list):
+            errors.append("%s pitches must be a list." % where)
+            pitches = structures.Octave.defaultPitches
+        # an Octave without pitches would leave nothing to render
+        if not pitches:
+            errors.append("%s needs at least one pitch." % where)
+        seen = []
+        for pitch in pitches:
+            if (not isinstance(pitch, str) or
+                    pitch not in structures.Octave.defaultPitches):
+                errors.append("%s has an unknown pitch %s." % (where, pitch))
+            elif pitch in seen:
+                errors.append("%s has the pitch %s more than once." % (
+                    where, pitch))
+            seen.append(pitch)
+    elif structType == "Volumes":
+        effect = definition.get("effect", "")
+        check_letter(errors, where, effect, "vpabcdefghVPABCDEFGH",
+            "a Volume Command of V, P, or A to H")
+        high = volume_high(str(effect).lower())
+        check_range(errors, where + " valueRange",
+            definition.get("valueRange", [0, high]), 0, high)
+    elif structType == "Effects":
+        check_letter(errors, where, definition.get("effect", ""),
+            "#\\ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+            "an Effect Type of #, \\, or A to Z")
+        check_range(errors, where + " valueRange",
+            definition.get("valueRange", [0, 255]), 0, 255)
+    elif structType == "Offsets":
+        check_range(errors, where + " valueRange",
+            definition.get("valueRange", [0, 255]), 0, 255)
+        check_range(errors, where + " sampleArea",
+            definition.get("sampleArea", [0, 0]), 0, 15)
+
+    for childType in LINKS.get(structType, ()):
+        check_children(errors, ids, where, structType, childType,
+            definition.get(childType.lower(), []))
+
+
+def check_definitions(document):
+    """
+    Check a whole document of structure definitions in one pass
+    Return a list of every problem found
+    """
+    errors = []
+    if not isinstance(document, dict):
+        return ["The document must be an object of structure lists."]
+    for structType in document:
+        if structType not in ORDER:
+            errors.append("%s are not a kind of structure." % structType)
+        elif not isinstance(document[structType], list):
+            errors.append("%s must be a list of definitions." % structType)
+    lists = dict((structType, document[structType]) for structType in ORDER
+                if isinstance(document.get(structType), list))
+    ids = {}
+    for structType in ORDER:
+        for definition in lists.get(structType, []):
+            if not isinstance(definition, dict) or not is_id(
+                    definition.get("id")):
+                continue
+            if definition["id"] in ids:
+                errors.append("The id %s is defined more than once." %
+                    definition["id"])
+            ids[definition["id"]] = structType
+    for structType in ORDER:
+        for n, definition in enumerate(lists.get(structType, [])):
+            check_definition(errors, ids, structType, n, definition)
+    return errors
+
+
+def build_definition(structType, definition):
+    """Make a structure from a definition, without any of its links"""
+    if structType == "Channels":
+        return structures.Channel(overwrite=definition.get("overwrite", True),
+            muted=definition.get("muted", False))
+    elif structType == "Instruments":
+        return structures.Instrument(definition["number"])
+    elif structType == "Octaves":
+        return structures.Octave(definition.get("number", 5),
+            definition.get("pitches", structures.Octave.defaultPitches))
+    elif structType == "Volumes":
+        high = volume_high(definition["effect"].lower())
+        return structures.Volume(definition["effect"].lower(),
+            tuple(definition.get("valueRange", (0, high))))
+    elif structType == "Effects":
+        return structures.Effect(definition["effect"],
+            tuple(definition.get("valueRange", (0, 255))))
+    elif structType == "Offsets":
+        return structures.Offset(tuple(definition.get("valueRange", (0, 255))),
+            tuple(definition.get("sampleArea", (0, 0))))
+
+
+def build_definitions(document):
+    """
+    Make every structure in a checked document of definitions and link
+    them together, children first so every link has something to point to
+    Return a dict of lists of (database, structure) by structure type
+    """
+    built = dict((structType, []) for structType in ORDER)
+    byId = {}
+    for structType in ORDER:
+        for definition in document.get(structType, []):
+            structure = build_definition(structType, definition)
+            if "id" in definition:
+                byId[definition["id"]] = structure
+            parentChildren = {}
+            if hasattr(structure, "children"):
+                parentChildren = structure.children()
+            for childType in LINKS.get(structType, ()):
+                children = definition.get(childType.lower(), [])
+                if isinstance(children, list):
+                    children = {"local": children}
+                pointer = parentChildren[childType]
+                pointer["useglobal"] = bool(children.get("useglobal", False))
+                if "spacing" in children:
+                    pointer["spacing"] = tuple(children["spacing"])
+                if children.get("local"):
+                    interface.add_children_to_parent(structure,
+                        [byId[childId] for childId in children["local"]])
+            built[structType].append(
+                (definition.get("database", "root"), structure))
+    return built
+
+
+def import_definitions(database, filename):
+    """
+    Import structures from a JSON document of definitions like
+    {"Octaves": [{"id": "low", "number": 3}], "Instruments": [{"id": "kick",
+    "number": 1, "octaves": ["low"]}], "Channels": [{"instruments":
+    {"local": ["kick"], "spacing": [3, 7]}}]}
+    Nothing is imported if any definition is invalid
+    Return a dict of how many of each structure type were imported
+    """
+    with open(filename, 'r') as infile:
+        try:
+            document = plain(json.load(infile))
+        except ValueError as error:
+            print("\n\"%s\" is not valid JSON. %s" % (filename, error))
+            return {}
+
+    errors = check_definitions(document)
+    if errors:
+        found = "problems were" if len(errors) != 1 else "problem was"
+        print("\nNothing was imported from \"%s\", as %s %s found:" % (
+            filename, len(errors), found))
+        for error in errors[:20]:
+            print(error)
+        if len(errors) > 20:
+            print("And %s more." % (len(errors) - 20))
+        return {}
+
+    counts = {}
+    for structType, new in build_definitions(document).items():
+        for curDB, structure in new:
+            history.insert(database[curDB][structType], structure)
+        counts[structType] = len(new)
+    return counts
+
+
+def import_patterns(database, curDB, filenames, workers=0):
+    """
+    Import structures from pattern files into a database
+    Return a dict of how many of each structure type were imported
+    """
+    built = build_structures(parse_files(filenames, workers))
+    counts = {}
+    for structType, new in built.items():
+        for structure in new:
+            history.insert(database[curDB][structType], structure)
+        counts[structType] = len(new)
+    return counts
+
+
+def import_files(database, curDB, workers=0):
+    """
+    Let the user import structures from pattern files into a database,
+    or from JSON files of structure definitions
+    """
+
+    prompt = ("Enter the names of the pattern or .json files to import from, "
+        "separated by spaces. Wildcards like *.txt are allowed.")
+    filenames = []
+    for pattern in ui.get_input(prompt, "preserve").split():
+        found = sorted(glob.glob(pattern))
+        if not found:
+            print("\nNo files match \"%s\"." % pattern)
+        filenames += found
+    if not filenames:
+        print("\nNo files to import from.")
+        return None
+
+    definitions = [name for name in filenames if name.endswith(".json")]
+    patterns = [name for name in filenames if not name.endswith(".json")]
+    counts = collections.Counter()
+    history.begin("import %s files" % len(filenames))
+    try:
+        for filename in definitions:
+            counts.update(import_definitions(database, filename))
+        if patterns:
+            counts.update(import_patterns(database, curDB, patterns, workers))
+    finally:
+        history.commit()
+
+    summary = ["%s %s" % (counts[structType], structType)
+                for structType in ORDER if counts[structType]]
+    print("\nImported %s from %s files." % (
+        ", ".join(summary) or "nothing", len(filenames)))
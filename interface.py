@@ -4,6 +4,7 @@ from __future__ import print_function
 
 """Provides an interface to let users create any structure"""
 
+import history
 import userinput as ui
 import structures
 
@@ -21,10 +22,26 @@ def paginate(array, pageLength=10):
     return pages
 
 
+def get_links(structure):
+    """Return every structure linked to or from a given structure"""
+    links = []
+    if hasattr(structure, "children"):
+        for children in structure.children().values():
+            links += children["local"]
+    if type(structure) == structures.Volume:
+        links += structure.usedBy["Channels"] + structure.usedBy["Instruments"]
+    elif type(structure) != structures.Channel:
+        links += structure.usedBy
+    return links
+
+
 def remove_all_links(structure):
     """Remove all links to and from a given structure"""
 
     structType = type(structure)
+    history.touch(structure)
+    for neighbour in get_links(structure):
+        history.touch(neighbour)
 
     if structType == structures.Channel:
         for instrument in structure.instruments["local"]:
@@ -72,6 +89,51 @@ def remove_all_links(structure):
         structure.usedBy = []
 
 
+def get_used_by(child, parent):
+    """Return the list of a child that links back to parents like parent"""
+    if type(child) != structures.Volume:
+        return child.usedBy
+    elif type(parent) == structures.Channel:
+        return child.usedBy["Channels"]
+    else:
+        return child.usedBy["Instruments"]
+
+
+def clone_structure(structure, clones, deep=False):
+    """
+    Clone a structure, linking the clone to the same children or,
+    if deep is True, to clones of its children
+    clones maps ids of structures to their clones, so children
+    shared within the copied structures are only cloned once
+    Return the clone
+    """
+    if id(structure) in clones:
+        return clones[id(structure)]
+    clone = object.__new__(type(structure))
+    vars(clone).update(history.capture(structure))
+    clones[id(structure)] = clone
+
+    # nothing uses a new clone until a cloned parent links to it
+    if type(clone) == structures.Channel:
+        clone.reset()
+    elif type(clone) == structures.Volume:
+        clone.usedBy = {"Channels": [], "Instruments": []}
+    else:
+        clone.usedBy = []
+
+    if hasattr(clone, "children"):
+        for children in clone.children().values():
+            originals = children["local"]
+            children["local"] = []
+            if deep:
+                originals = [clone_structure(child, clones, deep)
+                            for child in originals]
+            if originals:
+                add_children_to_parent(clone, originals)
+
+    return clone
+
+
 def add_children_to_parent(parent, children):
     """
     Adds as many children to parent as possible and store
@@ -81,7 +143,6 @@ def add_children_to_parent(parent, children):
     Octaves, Effects, Volumes, or Offsets
     """
 
-    parentType = type(parent)
     childType = type(children[0])
 
     if childType == structures.Instrument:
@@ -95,18 +156,13 @@ def add_children_to_parent(parent, children):
     elif childType == structures.Offset:
         pointer = parent.offsets
 
+    history.touch(parent)
     for child in children:
         if not child or child in pointer:
             continue
+        history.touch(child)
         pointer["local"].append(child)
-
-        if childType != structures.Volume:
-            child.usedBy.append(parent)
-        else:
-            if parentType == structures.Channel:
-                child.usedBy["Channels"].append(parent)
-            else:
-                child.usedBy["Instruments"].append(parent)
+        get_used_by(child, parent).append(parent)
 
 
 def configure_child(database, parent, childType):
@@ -117,6 +173,7 @@ def configure_child(database, parent, childType):
     "Volumes", or "Offsets", and assumes the parent has that child
     """
 
+    history.touch(parent)
     if type(parent) == structures.Channel:
         parentType = "Channel"
     elif type(parent) == structures.Instrument:
@@ -138,7 +195,7 @@ def configure_child(database, parent, childType):
 
     if ui.get_binary_choice("Add %s? Y/N" % childType):
         chosen = ui.make_mult_choice(
-            "Toggle %s to use. Press C to continue." % childType,
+            "Choose %s to use. Press C to continue." % childType,
             database["root"][childType] + database["global"][childType], "C")
         if chosen:
             add_children_to_parent(parent, chosen)
@@ -164,6 +221,7 @@ def make_channel(database):
 
 def edit_channel(database, channel):
     """Let the user edit an existing Channel"""
+    history.touch(channel)
 
     for childType in ("Instruments", "Volumes", "Effects"):
         configure_child(database, channel, childType)
@@ -191,6 +249,7 @@ def make_instrument(database):
 
 def edit_instrument(database, instrument):
     """Let the user edit an existing Instrument"""
+    history.touch(instrument)
     prompt = "Change Instrument number from %s? Y/N" % instrument.number
     if not instrument.number or ui.get_binary_choice(prompt):
         prompt = "Enter a number for the Instrument."
@@ -217,6 +276,7 @@ def make_octave():
 
 def edit_octave(octave):
     """Let the user edit an existing Octave"""
+    history.touch(octave)
     prompt = "Enter the Octave number. Currently it's %s."
     octave.number = ui.get_number(prompt % octave.number, 0, 9)
     prompt = "Change key limits? Y/N"
@@ -233,6 +293,7 @@ def make_volume():
 
 def edit_volume(volume):
     """Let the user edit an existing Volume"""
+    history.touch(volume)
     prompt = "Enter a Volume Command."
     if volume.effect:
         prompt += " Currently it's %s." % volume.effect
@@ -253,6 +314,7 @@ def make_effect():
 
 def edit_effect(effect):
     """Let the user create an Effect"""
+    history.touch(effect)
     prompt = "Enter an Effect Type."
     if effect.effect:
         prompt += " Currently it's %s." % effect.effect
@@ -269,6 +331,7 @@ def make_offset():
 
 def edit_offset(offset):
     """Let the user edit an existing Offset"""
+    history.touch(offset)
 
     print("\nCurrently: %s" % offset.range_info())
     prompts = ("Enter the %s Sample Area in hex.",
@@ -4,12 +4,25 @@ from __future__ import print_function
 
 """A Note and Effect randomizer for OpenMPT"""
 
+import merge
+import analyzer
+import parser
+import server
 import config
+import history
+import importer
+import footprint
 import tracker
+import watch
 import database as db
 import userinput as ui
 
 
+# commands that have to wait for the database to be loaded
+NEEDS_DATABASE = ("run", "preview", "memory", "analyze", "import",
+                "database", "undo", "redo", "load", "save")
+
+
 def init_aliases():
     """Initializes and returns command alias dicts"""
 
@@ -17,8 +30,16 @@ def init_aliases():
         "help": ("help", "readme", "info", "?"),
         "verbose": ("verbose", "verbosity"),
         "aliases": ("aliases", "aka"),
-        "repeat": ("repeat", "redo"),
+        "repeat": ("repeat",),
+        "undo": ("undo", "revert"),
+        "redo": ("redo",),
         "run": ("run", "produce", "generate"),
+        "preview": ("preview", "peek"),
+        "memory": ("memory", "footprint"),
+        "analyze": ("analyze", "analyse", "stats"),
+        "merge": ("merge", "overlay"),
+        "import": ("import", "ingest"),
+        "watch": ("watch", "follow"),
         "toggle": ("toggle", "mute", "unmute"),
         "switch": ("switch", "workon", "cd"),
         "global": ("global",),
@@ -51,35 +72,47 @@ def init_aliases():
     return aliases, dbAliases
 
 
+def reverse_aliases(aliases):
+    """Make a dict of every alias to the command it stands for"""
+    commands = {}
+    for command, names in aliases.items():
+        for name in names:
+            commands[name] = command
+    return commands
+
+
 def parse_args(args, needed):
     """
     Parse out a positional list of needed args
     needed is a list of lists of valid terms for each argument
-    If a inner list is empty, that means anything is valid
+    If a inner list is empty, that means anything is valid, and the arg
+    keeps its case, since it could be something like a filename
     Return a list of args if multiple needed, otherwise return a single arg
     """
     found = []
     argsLength = len(args)
     for pos, valid in enumerate(needed):
-        if pos >= argsLength or (valid and args[pos] not in valid):
+        if pos >= argsLength or (valid and args[pos].lower() not in valid):
             found.append("")
+        elif valid:
+            found.append(args[pos].lower())
         else:
             found.append(args[pos])
     return found
 
 
-def parse_database_command(dbAliases, command, givenArgs):
-    """Parse a command related to database affecting actions"""
+def parse_database_command(dbCommands, command, givenArgs):
+    """
+    Parse a command related to database affecting actions
+    dbCommands maps every database alias to its action
+    """
 
     structNames = ["channel", "channels", "instrument", "instruments",
         "octave", "octaves", "effect", "effects",
         "volume", "volumes", "offset", "offsets"]
     dbNames = ["global", "root", "default"]
 
-    # goes through whole dict, but it's quite small
-    for action, terms in dbAliases.items():
-        if command in terms:
-            command = action
+    command = dbCommands.get(command, command)
 
     args = parse_args(givenArgs, [structNames, dbNames])
     # if nothing was correct, try reverse order and swap the results
@@ -104,23 +137,24 @@ def parse_database_command(dbAliases, command, givenArgs):
     return args
 
 
-def parse_entry(aliases, dbAliases, entry):
+def parse_entry(commands, dbCommands, entry):
     """
     Parse a line of a command to verify it and patch it up as needed
+    commands and dbCommands map every alias to the command it stands for
     Return either a complete command and arg list, or blank data
     """
 
-    entry = entry.lower().split(" ")
+    entry = entry.split(" ")
     if len(entry) == 0:
         print("\nYou entered nothing.")
         return ("",)
+    # only the command is lowercased, as args can be case sensitive filenames
+    entry[0] = entry[0].lower()
     command = entry[0]
     args = entry[1:]
 
     # finds and applies master alias
-    for cmd, names in aliases.items():
-        if command in names:
-            command = cmd
+    command = commands.get(command, command)
 
     if command == "help":
         # check first arg
@@ -130,9 +164,18 @@ def parse_entry(aliases, dbAliases, entry):
         if args[0]:
             command = args[0]
     elif command == "database":
-        args = parse_database_command(dbAliases, entry[0], args)
+        args = parse_database_command(dbCommands, entry[0], args)
     elif command == "load":
         args = parse_args(args, [[], ["overwrite", "append"]])
+    elif command == "preview":
+        # the row count, colour, and a file to preview can come in any order
+        colors = ("color", "colour")
+        rows = [int(arg) for arg in args if arg.isdigit() and int(arg) > 0]
+        files = [arg for arg in args
+                 if arg and not arg.isdigit() and arg.lower() not in colors]
+        args = [rows[0] if rows else tracker.PREVIEW_ROWS,
+                any(arg.lower() in colors for arg in args),
+                files[0] if files else ""]
 
     elif command == "save":
         args = parse_args(args, [[], ["overwrite", "safe", "safely"]])
@@ -167,8 +210,12 @@ def change_database(curDB, command):
     return curDB
 
 
-def main_menu():
-    """Run the main menu of the program"""
+def main_menu(script=""):
+    """
+    Run the main menu of the program
+    If script names a file, its lines are used as the commands and
+    answers to every prompt, and the program quits once they run out
+    """
 
     repeat = False
     numberBase = "default"
@@ -177,35 +224,83 @@ def main_menu():
         "Enter a valid command, or help.")
 
     aliases, dbAliases = init_aliases()
+    commands = reverse_aliases(aliases)
+    dbCommands = reverse_aliases(dbAliases)
+    if script:
+        with open(script, 'r') as scriptFile:
+            ui.load_script(scriptFile)
     dbConfig, production = config.init_config_file()
-    database = db.init(dbConfig)
+    # the database loads in the background while commands that don't
+    # need it, like help, can already be used
+    preload = db.Preload(dbConfig)
+    database = None
+    history.set_limit(dbConfig["history"])
 
     command = ""
-    while command != "quit":
-        entry = ui.get_input(
-            prompt % (("on" if repeat else "off"), curDB), "lower")
-        command, args = parse_entry(aliases, dbAliases, entry)
-
-        if command == "help":
-            print("\nI'm working on the help file!!")
-        elif command == "repeat":
-            repeat = not repeat
-            print("\nRepeat is now %s." % ("on" if repeat else "off"))
-        elif command == "run":
-            tracker.produce(database, production)
-        elif command in ("switch", "root", "global"):
-            curDB = change_database(curDB, command)
-        elif command == "database":
-            db.basic_actions(database, curDB, *tuple(args))
-        elif command == "load":
-            db.load(database, *tuple(args))
-        elif command == "save":
-            db.save(database, dbConfig, *tuple(args))
-        elif command == "wipe":
-            wipePrompt = "Are you SURE you want to erase the database? Y/N"
-            if ui.get_binary_choice(wipePrompt):
-                database = db.init()
-        elif command != "quit":
-            print("\n\"%s\" is not a recognized command." % command)
-
-main_menu()
\ No newline at end of file
+    # a script running out of lines ends the program, even mid-command
+    try:
+        while command != "quit":
+            entry = ui.get_input(
+                prompt % (("on" if repeat else "off"), curDB), "preserve")
+            command, args = parse_entry(commands, dbCommands, entry)
+            if database is None and command in NEEDS_DATABASE:
+                database = preload.result()
+
+            if command == "help":
+                print("\nI'm working on the help file!!")
+            elif command == "repeat":
+                repeat = not repeat
+                print("\nRepeat is now %s." % ("on" if repeat else "off"))
+            elif command == "run":
+                tracker.produce(database, production)
+            elif command == "merge":
+                merge.merge()
+            elif command == "preview":
+                rows, color, filename = args
+                if filename:
+                    merge.preview_file(filename, rows, color)
+                else:
+                    tracker.preview(database, production, rows, color)
+            elif command == "analyze":
+                analyzer.analyze(database)
+            elif command == "memory":
+                footprint.show(database)
+            elif command == "watch":
+                watch.watch(dbConfig, production)
+            elif command == "import":
+                importer.import_files(database, curDB, production["workers"])
+            elif command in ("switch", "root", "global"):
+                curDB = change_database(curDB, command)
+            elif command == "database":
+                db.basic_actions(database, curDB, *tuple(args))
+            elif command in ("undo", "redo"):
+                if command == "undo":
+                    edit, done = history.undo(), "Undid"
+                else:
+                    edit, done = history.redo(), "Redid"
+                if edit is None:
+                    print("\nThere is nothing to %s." % command)
+                else:
+                    print("\n%s \"%s\"." % (done, edit))
+            elif command == "load":
+                db.load(database, *tuple(args))
+                history.clear()
+            elif command == "save":
+                db.save(database, dbConfig, *tuple(args))
+            elif command == "wipe":
+                wipePrompt = "Are you SURE you want to erase the database? Y/N"
+                if ui.get_binary_choice(wipePrompt):
+                    database = db.init()
+                    history.clear()
+            elif command != "quit":
+                print("\n\"%s\" is not a recognized command." % command)
+    except EOFError:
+        # Ctrl+D at the terminal just quits
+        if ui.scripted is not None:
+            print("\nReached the end of the script.")
+
+args = parser.parse()
+if args["serve"] is not None:
+    server.serve(args["serve"], args["serve_dir"])
+else:
+    main_menu(args["script"])
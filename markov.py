@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+A generation engine that learns from existing OpenMPT pattern files
+instead of drawing every cell independently from the database
+"""
+
+import os
+import array
+import bisect
+import collections
+
+import merge
+import importer
+
+
+def compile_counts(counts):
+    """
+    Turn a Counter of token indexes into a compact table of
+    (token indexes, cumulative counts) arrays for sampling by bisect
+    """
+    tokens = array.array("L")
+    cumulative = array.array("L")
+    total = 0
+    for token, count in sorted(counts.items()):
+        total += count
+        tokens.append(token)
+        cumulative.append(total)
+    return tokens, cumulative
+
+
+def sample(table, rng):
+    """Draw a token index from a table made by compile_counts"""
+    tokens, cumulative = table
+    roll = int(rng.random() * cumulative[-1])
+    return tokens[bisect.bisect_right(cumulative, roll)]
+
+
+class Model(object):
+
+    def __init__(self):
+        # every distinct note/instrument and volume/effect seen
+        self.notes = []
+        self.rests = []
+        # per column tables of how each column starts, and then of
+        # note index -> next note index
+        self.starts = []
+        self.transitions = []
+        # note index -> volume/effect index found in the same cell
+        self.pairs = {}
+        # (filename, size, modified time) of every file trained on
+        self.sources = []
+
+    def __str__(self):
+        return ("Markov model of %s Channels, %s notes, and %s "
+            "volume/effect pairs." % (len(self.transitions),
+                len(self.notes), len(self.rests)))
+
+
+def intern_token(tokens, indexes, token):
+    """Return the index of token, adding it to tokens if it's new"""
+    index = indexes.get(token)
+    if index is None:
+        index = indexes[token] = len(tokens)
+        tokens.append(token)
+    return index
+
+
+def train(filenames):
+    """
+    Learn a Model from pattern files, or return None if they held nothing
+    Preserved (space) cells are treated as blank
+    """
+    model = Model()
+    noteIndexes = {}
+    restIndexes = {}
+    starts = []
+    transitions = []
+    pairs = collections.defaultdict(collections.Counter)
+
+    for filename in filenames:
+        info = os.stat(filename)
+        model.sources.append((filename, info.st_size, info.st_mtime))
+        previous = []
+        with merge.open_pattern(filename) as mapped:
+            try:
+                for row in merge.read_rows(mapped):
+                    row = row.replace(" ", ".")
+                    columns = len(row) // importer.CELL_WIDTH
+                    while len(transitions) < columns:
+                        starts.append(collections.Counter())
+                        transitions.append(
+                            collections.defaultdict(collections.Counter))
+                    current = []
+                    for column in xrange(columns):
+                        start = column * importer.CELL_WIDTH + 1
+                        note = intern_token(model.notes, noteIndexes,
+                            row[start:start + 5])
+                        rest = intern_token(model.rests, restIndexes,
+                            row[start + 5:start + 11])
+                        pairs[note][rest] += 1
+                        if column < len(previous):
+                            transitions[column][previous[column]][note] += 1
+                        else:
+                            starts[column][note] += 1
+                        current.append(note)
+                    previous = current
+            except ValueError as error:
+                print("\nSkipped \"%s\". %s" % (filename, error))
+
+    if not starts:
+        return None
+    model.starts = [compile_counts(counts) for counts in starts]
+    for column in transitions:
+        model.transitions.append(dict((note, compile_counts(counts))
+            for note, counts in column.items()))
+    model.pairs = dict((note, compile_counts(counts))
+        for note, counts in pairs.items())
+    return model
+
+
+def prepare_channel(model, state, column):
+    """
+    Ready the state of a Channel to be generated from the given column
+    of model
+    The state's rng must already be seeded
+    """
+    column %= len(model.starts)
+    state.chain = [column, None]
+
+
+def get_channel_line(model, state):
+    """Generates a single line for a channel from a Model"""
+
+    if state.muted:
+        return "|" + " " * 11
+
+    column, note = state.chain
+    table = model.transitions[column].get(note)
+    if table is None:
+        table = model.starts[column]
+    note = sample(table, state.rng)
+    state.chain[1] = note
+    line = "|" + model.notes[note] + model.rests[
+        sample(model.pairs[note], state.rng)]
+
+    if not state.overwrite:
+        line = line.replace(".", " ")
+    return line
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+Overlays generated tracker notes onto an existing pattern, so Channels
+that don't overwrite keep whatever was already there
+"""
+
+import re
+import mmap
+import itertools
+import contextlib
+
+import sinks
+import tracker
+import importer
+import userinput as ui
+
+# a generated space means "preserve what's already there"
+PRESERVED = re.compile(" +")
+
+
+@contextlib.contextmanager
+def map_file(filename):
+    """Memory map a file read-only, yielding None if it's empty"""
+    with open(filename, 'rb') as infile:
+        infile.seek(0, 2)
+        if not infile.tell():
+            yield None
+        else:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mapped
+            finally:
+                mapped.close()
+
+
+@contextlib.contextmanager
+def open_pattern(filename):
+    """
+    Open a pattern file for read_rows, decompressing it as it's read
+    if it's compressed, and memory mapping it otherwise
+    """
+    if sinks.compression(filename):
+        with sinks.open_compressed(filename) as infile:
+            yield infile
+    else:
+        with map_file(filename) as mapped:
+            yield mapped
+
+
+def read_rows(mapped):
+    """
+    Lazily read the rows of a mapped or opened pattern file after its header
+    Raise a ValueError if the header isn't the one OpenMPT writes
+    """
+    if mapped is None:
+        raise ValueError("The file is empty.")
+    if mapped.readline().rstrip("\r\n") != tracker.HEADER.rstrip("\n"):
+        raise ValueError("The file is not an OpenMPT pattern.")
+    row = mapped.readline()
+    while row:
+        yield row.rstrip("\r\n")
+        row = mapped.readline()
+
+
+def merge_row(existing, generated):
+    """
+    Merge a generated row over an existing one, column by column
+    Preserved columns with nothing under them are left blank
+    """
+    if len(existing) < len(generated):
+        existing += "." * (len(generated) - len(existing))
+    merged = []
+    last = 0
+    for match in PRESERVED.finditer(generated):
+        merged.append(generated[last:match.start()])
+        merged.append(existing[match.start():match.end()])
+        last = match.end()
+    merged.append(generated[last:])
+    # the existing row may hold more Channels than were generated
+    merged.append(existing[len(generated):])
+    return "".join(merged)
+
+
+def merge_files(existingFile, generatedFile, mergedFile):
+    """
+    Stream generatedFile merged over existingFile into mergedFile
+    Neither file is ever read into memory as a whole
+    Return the number of rows written
+    """
+    written = 0
+    with open_pattern(existingFile) as existing, \
+            open_pattern(generatedFile) as generated, \
+            sinks.open_sink(mergedFile) as outfile:
+        existingRows = read_rows(existing)
+        generatedRows = read_rows(generated)
+        outfile.write(tracker.HEADER)
+        for row in generatedRows:
+            outfile.write(merge_row(next(existingRows, ""), row) + "\n")
+            written += 1
+        # rows past the end of the generated file are kept as they are
+        for row in existingRows:
+            outfile.write(row + "\n")
+            written += 1
+    return written
+
+
+def preview_file(filename, rows, color=False):
+    """
+    Print the first rows of a pattern file, reading no more of it
+    than those rows
+    """
+    try:
+        with open_pattern(filename) as pattern:
+            shown = list(itertools.islice(read_rows(pattern), rows))
+    except ValueError as error:
+        print("\nCould not preview \"%s\". %s" % (filename, error))
+        return None
+    print("\nPreviewing %s rows of \"%s\"." % (len(shown), filename))
+    channels = max([len(row) for row in shown] + [0]) // importer.CELL_WIDTH
+    tracker.show_rows(shown, channels, color)
+
+
+def merge():
+    """Let the user merge a generated pattern over an existing one"""
+
+    existingFile = ui.get_filename(
+        "Enter the name of the existing pattern file.", 'r')
+    if not existingFile:
+        return None
+    generatedFile = ui.get_filename(
+        "Enter the name of the generated pattern file.", 'r')
+    if not generatedFile:
+        return None
+    mergedFile = ui.get_filename(
+        "Enter the name of a file to write the merged pattern to.", 'w')
+    if not mergedFile:
+        return None
+
+    try:
+        rows = merge_files(existingFile, generatedFile, mergedFile)
+    except ValueError as error:
+        print("\nCould not merge the files. %s" % error)
+    else:
+        print("\nMerged %s rows into \"%s\"." % (rows, mergedFile))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+Manages a directory of renders, giving each one an auto-numbered name in
+a hashed subdirectory, and keeping a manifest of what was written when
+The manifest doubles as the index of names in use, so the directory is
+never listed to find a free name
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+
+import sinks
+
+MANIFEST = "manifest.jsonl"
+NUMBER_WIDTH = 6
+# how many hex digits of a name's hash its subdirectory is named with
+FANOUT = 2
+NUMBERED = re.compile(r"^(.*)_(\d+)(\..*)?$")
+
+# root directory -> OutputManager, so each index is only read once
+managers = {}
+
+
+class OutputManager(object):
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest = os.path.join(root, MANIFEST)
+        self.names = set()
+        # (stem, extension) -> highest number used
+        self.counters = {}
+        if os.path.isfile(self.manifest):
+            with open(self.manifest, 'r') as infile:
+                for line in infile:
+                    if line.strip():
+                        self.add(json.loads(line)["name"])
+
+    def __str__(self):
+        return "%s renders in \"%s\"." % (len(self.names), self.root)
+
+    def add(self, name):
+        """Add a name to the index, counting it if it's numbered"""
+        self.names.add(name)
+        match = NUMBERED.match(name)
+        if match:
+            key = (match.group(1), match.group(3) or "")
+            self.counters[key] = max(self.counters.get(key, 0),
+                int(match.group(2)))
+
+    def path_of(self, name):
+        """Get the path a name is kept at, in its hashed subdirectory"""
+        subdirectory = hashlib.md5(name).hexdigest()[:FANOUT]
+        return os.path.join(self.root, subdirectory, name)
+
+    def allocate(self, stem, ext):
+        """
+        Reserve the next free name like stem_000123.ext, making its
+        subdirectory if needed
+        Return the path to write it to
+        """
+        number = self.counters.get((stem, ext), 0)
+        while True:
+            number += 1
+            name = "%s_%0*d%s" % (stem, NUMBER_WIDTH, number, ext)
+            path = self.path_of(name)
+            # files put there by hand are only found by a single stat
+            if name not in self.names and not os.path.exists(path):
+                break
+        self.add(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        return path
+
+    def record(self, path):
+        """Add a written file to the manifest"""
+        name = os.path.basename(path)
+        self.add(name)
+        entry = {"name": name, "path": os.path.relpath(path, self.root),
+            "bytes": os.path.getsize(path),
+            "written": time.strftime("%Y-%m-%d %H:%M:%S")}
+        with open(self.manifest, 'a') as outfile:
+            outfile.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def get_manager(root):
+    """Return the OutputManager of a directory, making it if needed"""
+    if root not in managers:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        managers[root] = OutputManager(root)
+    return managers[root]
+
+
+def allocate(root, filename):
+    """
+    Reserve a numbered name in the output directory root, taking the
+    stem and extension from filename, or song.txt if it's blank
+    Return the path to write it to
+    """
+    stem, ext = sinks.split_name(os.path.basename(filename or "song.txt"))
+    path = get_manager(root).allocate(stem, ext or ".txt")
+    print("\nWriting to \"%s\"." % path)
+    return path
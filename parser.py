@@ -6,12 +6,18 @@ from __future__ import print_function
 
 import argparse
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-x")
+parser = argparse.ArgumentParser(description=
+    "A Note and Effect randomizer for OpenMPT.")
+parser.add_argument("-s", "--script", default="",
+    help="run the main menu commands and prompt answers in a file, "
+        "one per line, instead of reading them from the terminal")
+parser.add_argument("--serve", type=int, metavar="PORT",
+    help="serve renders of saved databases over HTTP on a local port "
+        "instead of running the main menu")
+parser.add_argument("--serve-dir", default=".", metavar="DIR",
+    help="the directory the server may load databases from, "
+        "which is the current one by default")
 
 def parse(argv=None):
-    args = vars(parser.parse_args(argv))
-    print(args)
-
-parse()
-parse(["-x", "5"])
\ No newline at end of file
+    """Parse command line args into a dict"""
+    return vars(parser.parse_args(argv))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+Keeps rendered tracker songs on disk, so producing the same database
+with the same settings again just copies the earlier render
+"""
+
+import os
+import shutil
+import hashlib
+
+# bump whenever the same settings would render something different
+RENDER_VERSION = 2
+
+
+def make_key(digest, seed, lines, engine, rng, model=None, compression=""):
+    """
+    Make the key a render is cached under
+    digest is the compiled.plan_digest of the Plan being rendered, and
+    compression is the extension of the render's compression, if any
+    """
+    parts = (RENDER_VERSION, digest, seed, lines, engine, rng,
+            model.sources if model is not None else None, compression)
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+def cached_path(cache, key):
+    """Get the path a render is cached at"""
+    return os.path.join(cache["location"], key + ".txt")
+
+
+def fetch(cache, key, filename):
+    """
+    Copy a cached render to filename if there is one
+    Return True if it was found, and False otherwise
+    """
+    if not cache["size"]:
+        return False
+    path = cached_path(cache, key)
+    if not os.path.isfile(path):
+        return False
+    shutil.copyfile(path, filename)
+    # marks the render as recently used
+    os.utime(path, None)
+    print("Copied an identical earlier render from the cache.")
+    return True
+
+
+def store(cache, key, filename):
+    """Cache a render, evicting the least recently used ones to fit"""
+    if not cache["size"]:
+        return None
+    if not os.path.isdir(cache["location"]):
+        os.makedirs(cache["location"])
+    shutil.copyfile(filename, cached_path(cache, key))
+    evict(cache)
+
+
+def evict(cache):
+    """Delete the least recently used renders until the cache fits"""
+    renders = []
+    total = 0
+    for name in os.listdir(cache["location"]):
+        path = os.path.join(cache["location"], name)
+        if name.endswith(".txt") and os.path.isfile(path):
+            info = os.stat(path)
+            renders.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+    limit = cache["size"] * 1024 * 1024
+    for used, size, path in sorted(renders):
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+A local HTTP server that keeps compiled databases in memory, so other
+tools can request fresh tracker notes without the interactive program
+Databases can only be loaded from the directory the server is given
+
+GET /render?database=FILE&lines=N[&seed=N][&channels=FIRST-LAST][&rng=NAME]
+    streams a tracker song row by row as it's generated
+GET /metrics
+    returns request latency statistics as JSON
+"""
+
+import os
+import json
+import time
+import pickle
+import random
+import socket
+import urlparse
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+import tracker
+import compiled
+
+# how many recent requests latency statistics are kept for
+METRICS_WINDOW = 1000
+
+
+class Library(object):
+    """
+    Loaded and compiled databases, reloaded when their file changes
+    Only files inside the root directory can be loaded
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        # guards plans and fileLocks, but never a load
+        self.lock = threading.Lock()
+        # path -> (modified time, Plan)
+        self.plans = {}
+        # path -> Lock held while that file is loaded and compiled
+        self.fileLocks = {}
+
+    def resolve(self, filename):
+        """
+        Get the real path of a database file in the root directory
+        Raise ValueError if it's anywhere else
+        """
+        path = os.path.realpath(os.path.join(self.root, filename))
+        if not path.startswith(os.path.join(self.root, "")):
+            raise ValueError("database must be a file in %s." % self.root)
+        return path
+
+    def get(self, filename):
+        """Return the Plan of a database file, compiling it if needed"""
+        path = self.resolve(filename)
+        with self.lock:
+            fileLock = self.fileLocks.setdefault(path, threading.Lock())
+        # only requests for the same file wait on each other
+        with fileLock:
+            mtime = os.stat(path).st_mtime
+            with self.lock:
+                cached = self.plans.get(path)
+            if cached is None or cached[0] != mtime:
+                try:
+                    with open(path, 'r') as infile:
+                        database = pickle.load(infile)
+                    cached = (mtime, compiled.compile_database(database))
+                except Exception as error:
+                    raise ValueError("\"%s\" is not a saved database. %s" %
+                        (filename, error))
+                with self.lock:
+                    self.plans[path] = cached
+            return cached[1]
+
+
+class Metrics(object):
+    """Latency of recent requests, to the first row and to the last"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.firstRows = collections.deque(maxlen=METRICS_WINDOW)
+        self.totals = collections.deque(maxlen=METRICS_WINDOW)
+
+    def record(self, firstRow, total):
+        """Record the seconds a request took to its first and last rows"""
+        with self.lock:
+            self.requests += 1
+            self.firstRows.append(firstRow)
+            self.totals.append(total)
+
+    def record_error(self):
+        """Record a request that couldn't be rendered"""
+        with self.lock:
+            self.requests += 1
+            self.errors += 1
+
+    def summary(self):
+        """Return a dict of statistics in milliseconds"""
+        with self.lock:
+            stats = {"requests": self.requests, "errors": self.errors}
+            for name, times in (("firstRow", self.firstRows),
+                                ("total", self.totals)):
+                ordered = sorted(times)
+                if not ordered:
+                    continue
+                stats[name] = {
+                    "mean": 1000 * sum(ordered) / len(ordered),
+                    "p50": 1000 * ordered[len(ordered) // 2],
+                    "p95": 1000 * ordered[int(len(ordered) * 0.95)],
+                    "max": 1000 * ordered[-1]}
+            return stats
+
+
+def parse_channels(text, total):
+    """
+    Parse a FIRST-LAST range of Channel positions, counting from 0,
+    of no more Channels than OpenMPT allows
+    Return a (first, count) tuple, or raise ValueError
+    """
+    if not text:
+        return 0, min(total, tracker.MAX_CHANNELS)
+    first, _, last = text.partition("-")
+    first = int(first)
+    last = int(last) if last else first
+    if not 0 <= first <= last < total:
+        raise ValueError("Channels must be between 0 and %s." % (total - 1))
+    # like produce, anything wider than OpenMPT allows has to be sharded
+    if last - first + 1 > tracker.MAX_CHANNELS:
+        raise ValueError("At most %s Channels can be rendered at once." %
+            tracker.MAX_CHANNELS)
+    return first, last - first + 1
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        if url.path == "/render":
+            self.render(urlparse.parse_qs(url.query))
+        elif url.path == "/metrics":
+            self.respond(200, "application/json",
+                json.dumps(self.server.metrics.summary(), sort_keys=True))
+        else:
+            self.send_error(404)
+
+    def respond(self, code, contentType, body):
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def render(self, query):
+        """Stream a tracker song for the query, row by row"""
+        started = time.time()
+        get = lambda name: query.get(name, [""])[0]
+        try:
+            plan = self.server.library.get(get("database"))
+            lines = int(get("lines"))
+            if lines < 1:
+                raise ValueError("lines must be at least 1.")
+            seed = int(get("seed")) if get("seed") else random.randint(
+                0, 2 ** 32 - 1)
+            first, count = parse_channels(get("channels"),
+                plan.channel_count())
+            rng = get("rng") or "mersenne"
+            if rng not in tracker.RNGS:
+                raise ValueError("rng must be one of %s." % ", ".join(
+                    sorted(tracker.RNGS)))
+        except (ValueError, IOError, OSError) as error:
+            self.server.metrics.record_error()
+            self.respond(400, "text/plain", "%s\n" % error)
+            return None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("X-Seed", str(seed))
+        self.end_headers()
+        firstRow = None
+        states = tracker.init_channels(plan, seed, first, count, rng=rng)
+        try:
+            self.wfile.write(tracker.HEADER)
+            for line in tracker.generate_rows(plan, states, lines):
+                self.wfile.write(line + "\n")
+                if firstRow is None:
+                    firstRow = time.time() - started
+                    self.wfile.flush()
+        except socket.error:
+            # the client went away before the song was finished
+            self.server.metrics.record_error()
+            return None
+        self.server.metrics.record(firstRow, time.time() - started)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RenderServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Handles every request on its own thread"""
+
+    daemon_threads = True
+
+    def __init__(self, address, root="."):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RenderHandler)
+        self.library = Library(root)
+        self.metrics = Metrics()
+
+
+def serve(port, root=".", host="127.0.0.1"):
+    """
+    Serve renders of the databases in the root directory on a local port
+    until interrupted
+    """
+    server = RenderServer((host, port), root)
+    print("Serving renders of \"%s\" on http://%s:%s/render. Press Ctrl+C "
+        "to stop." % (server.library.root, host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped serving.")
+    finally:
+        server.server_close()
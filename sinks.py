@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+"""
+Picks how tracker notes are written and read from a file's extension,
+compressing them as they stream if it ends in .gz or .bz2
+"""
+
+import os
+import bz2
+import gzip
+
+# gzip's default of 9 barely shrinks tracker notes more, but is much slower
+GZIP_LEVEL = 6
+
+
+def open_gzip(filename, mode):
+    """Open a gzip file at the level tracker notes are written at"""
+    return gzip.open(filename, mode, GZIP_LEVEL)
+
+
+# extension -> function opening a file compressed that way
+COMPRESSORS = {".gz": open_gzip, ".bz2": bz2.BZ2File}
+
+
+def compression(filename):
+    """Return the compression extension of filename, or "" if it has none"""
+    ext = os.path.splitext(filename)[1].lower()
+    return ext if ext in COMPRESSORS else ""
+
+
+def split_name(filename):
+    """
+    Split filename into its root and extension, where the extension
+    includes any compression, like .txt.gz
+    """
+    ext = compression(filename)
+    root, inner = os.path.splitext(filename[:len(filename) - len(ext)])
+    return root, inner + ext
+
+
+def open_sink(filename):
+    """Open filename to write to, compressing what's written if needed"""
+    ext = compression(filename)
+    if ext:
+        return COMPRESSORS[ext](filename, 'wb')
+    return open(filename, 'w')
+
+
+def open_compressed(filename):
+    """Open a compressed file to read from, decompressing as it's read"""
+    return COMPRESSORS[compression(filename)](filename, 'rb')
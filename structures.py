@@ -2,22 +2,43 @@
 
 """Class objects defining aspects of a tracker production"""
 
+import hashlib
+
 
 def plural(value):
     """Get an "s" or "" depending on value"""
     return "s" if value != 1 else ""
 
 
+def content_hash(structure, digests):
+    """
+    Return a hash of the content of a structure, including the content
+    of every structure it links to (but not the ones using it)
+    digests caches hashes by id, so it must not outlive the structures
+    """
+    key = id(structure)
+    if key not in digests:
+        content = structure.content(lambda child: content_hash(child, digests))
+        digests[key] = hashlib.sha1(repr(content)).hexdigest()
+    return digests[key]
+
+
+def children_content(children, hashOf):
+    """Get the canonical content of one of a structure's child dicts"""
+    hashes = tuple(sorted(set(hashOf(child) for child in children["local"])))
+    return hashes, children["useglobal"], tuple(children.get("spacing", ()))
+
+
 class Channel(object):
 
     def __init__(self, instruments=[], volumes=[], effects=[],
                 overwrite=True, muted=False):
 
-        self.instruments = {"local": list(instruments), "useGlobal": False,
+        self.instruments = {"local": list(instruments), "useglobal": False,
             "spacing": (0, 0), "curSpacing": 0}
-        self.volumes = {"local": list(volumes), "useGlobal": False,
+        self.volumes = {"local": list(volumes), "useglobal": False,
             "spacing": (0, 0), "curSpacing": 0}
-        self.effects = {"local": list(effects), "useGlobal": False,
+        self.effects = {"local": list(effects), "useglobal": False,
             "spacing": (0, 0), "curSpacing": 0}
         self.overwrite = overwrite
         self.muted = muted
@@ -37,15 +58,15 @@ class Channel(object):
 
         n = len(self.instruments["local"])
         info = "Uses %s Instrument%s%s " % (n, plural(n),
-            " (G)" * self.instruments["useGlobal"])
+            " (G)" * self.instruments["useglobal"])
         info += "at %s-%s, " % self.instruments["spacing"]
         n = len(self.volumes["local"])
         info += "%s Volume%s%s " % (n, plural(n),
-            " (G)" * self.volumes["useGlobal"])
+            " (G)" * self.volumes["useglobal"])
         info += "at %s-%s, " % self.volumes["spacing"]
         n = len(self.effects["local"])
         info += "and %s Effect%s%s " % (n, plural(n),
-            " (G)" * self.effects["useGlobal"])
+            " (G)" * self.effects["useglobal"])
         info += "at %s-%s. " % self.effects["spacing"]
 
         info += "Overwriting. " if self.overwrite else "Preserving. "
@@ -53,14 +74,26 @@ class Channel(object):
 
         return info
 
+    def children(self):
+        """Return the dicts of children of a Channel by structure type"""
+        return {"Instruments": self.instruments, "Volumes": self.volumes,
+                "Effects": self.effects}
+
+    def content(self, hashOf):
+        """Return the canonical content of a Channel"""
+        return ("Channel", children_content(self.instruments, hashOf),
+                children_content(self.volumes, hashOf),
+                children_content(self.effects, hashOf),
+                self.overwrite, self.muted)
+
 
 class Instrument(object):
 
     def __init__(self, number=0, octaves=[], volumes=[], offsets=[]):
         self.number = number
-        self.octaves = {"local": list(octaves), "useGlobal": False}
-        self.volumes = {"local": list(volumes), "useGlobal": False}
-        self.offsets = {"local": list(offsets), "useGlobal": False}
+        self.octaves = {"local": list(octaves), "useglobal": False}
+        self.volumes = {"local": list(volumes), "useglobal": False}
+        self.offsets = {"local": list(offsets), "useglobal": False}
         self.usedBy = []
 
     def __str__(self):
@@ -69,13 +102,13 @@ class Instrument(object):
 
         n = len(self.octaves["local"])
         info += "Uses %s Octave%s%s, " % (n, plural(n),
-            " (G)" * self.octaves["useGlobal"])
+            " (G)" * self.octaves["useglobal"])
         n = len(self.volumes["local"])
         info += "%s Volume%s%s, " % (n, plural(n),
-            " (G)" * self.volumes["useGlobal"])
+            " (G)" * self.volumes["useglobal"])
         n = len(self.offsets["local"])
         info += "and %s Offset%s%s. " % (n, plural(n),
-            " (G)" * self.offsets["useGlobal"])
+            " (G)" * self.offsets["useglobal"])
 
         if self.usedBy:
             n = len(self.usedBy)
@@ -85,6 +118,18 @@ class Instrument(object):
 
         return info
 
+    def children(self):
+        """Return the dicts of children of an Instrument by structure type"""
+        return {"Octaves": self.octaves, "Volumes": self.volumes,
+                "Offsets": self.offsets}
+
+    def content(self, hashOf):
+        """Return the canonical content of an Instrument"""
+        return ("Instrument", self.number,
+                children_content(self.octaves, hashOf),
+                children_content(self.volumes, hashOf),
+                children_content(self.offsets, hashOf))
+
 
 class Octave(object):
 
@@ -110,6 +155,10 @@ class Octave(object):
             info += " Not in use."
         return info
 
+    def content(self, hashOf):
+        """Return the canonical content of an Octave"""
+        return ("Octave", self.number, tuple(self.pitches))
+
 
 class Effect(object):
 
@@ -135,6 +184,10 @@ class Effect(object):
 
         return info
 
+    def content(self, hashOf):
+        """Return the canonical content of an Effect"""
+        return (type(self).__name__, self.effect, tuple(self.valueRange))
+
 
 class Volume(Effect):
 
@@ -174,6 +227,10 @@ class Offset(Effect):
             info += " Not in use."
         return info
 
+    def content(self, hashOf):
+        """Return the canonical content of an Offset"""
+        return ("Offset", tuple(self.valueRange), tuple(self.sampleArea))
+
     def range_info(self):
         """Create a text representation of the offset values"""
         
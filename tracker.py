@@ -5,70 +5,109 @@ Generates a completely randomized arrangement of notes for OpenMPT tracker
 format, using an inter-connected database of musical structures
 """
 
+import glob
+import json
 import random
+import hashlib
+import itertools
+import Queue
+import threading
+import multiprocessing
+
+import sinks
+import config as cfg
+import outputs
+import markov
+import importer
+import compiled
+import rendercache
 import userinput as ui
 import structures
 
-
-def get_random_value(valueRange):
+# OpenMPT does not allow more Channels than this in a single pattern
+MAX_CHANNELS = 127
+# header required for OpenMPT to parse file
+HEADER = "ModPlug Tracker  IT\n"
+# random number generators a Channel can be seeded with
+RNGS = {"mersenne": random.Random, "wichmann": random.WichmannHill}
+# (RNG backend, rows per written block, blocks waiting to be written)
+DEFAULT_TUNING = ("mersenne", 64, 8)
+# rows of every Channel generated at a time, before they're joined into
+# lines, when there's no row block size to use instead
+COLUMN_ROWS = 256
+
+# how many rows preview shows when it isn't told
+PREVIEW_ROWS = 16
+# ANSI colours for the note, volume, and effect parts of a previewed cell
+PREVIEW_COLORS = ("\033[36m", "\033[32m", "\033[35m")
+PREVIEW_RESET = "\033[0m"
+
+# the Plan and Model a pool worker renders shards from
+workerPlan = None
+workerModel = None
+
+
+def get_random_value(valueRange, rng=random):
     """
     Get a random value from within a valueRange
     valueRange is a list or tuple holding the low and high values
     """
-    return random.randint(valueRange[0], valueRange[1])
+    return rng.randint(valueRange[0], valueRange[1])
 
 
-def tick_spacing(child):
+def tick_spacing(plan, state, field):
     """
     Decrement/reset the current spacing of a child of a Channel
     Return True if the Channel should generate output for that child,
     and False otherwise
-    child must be one of Channel's Instrument, Volume, or Effect dicts
+    field must be one of compiled.INSTRUMENTS, VOLUMES, or EFFECTS
     """
-    if child["curSpacing"] <= 0:
-        child["curSpacing"] = get_random_value(child["spacing"])
+    kind = (field - compiled.INSTRUMENTS) // compiled.CHILD_WIDTH
+    if state.spacing[kind] <= 0:
+        row = state.channel * compiled.CHANNEL_STRIDE + field
+        state.spacing[kind] = get_random_value(
+            plan.channels[row + 2:row + 4], state.rng)
         return True
     else:
-        child["curSpacing"] -= 1
+        state.spacing[kind] -= 1
         return False
 
 
-def get_random_child(children, globalChildren, useglobal):
+def get_random_child(plan, table, field, rng=random):
     """
-    Get a random child from a list of children, and
-    optionally a list of global children
+    Get the row of a random child, from the candidates listed at field
+    of a row in one of plan's tables
     If there are no children available, it returns None
     """
-    possible = list(children)
-    if useglobal:
-        for child in globalChildren:
-            if child not in possible:
-                possible.append(child)
-    if possible == []:
+    start, count = table[field], table[field + 1]
+    if not count:
         return None
-    return possible[random.randint(0, len(possible) - 1)]
+    return plan.candidates[start + rng.randint(0, count - 1)]
 
 
-def get_instrument(globalDB, channel):
+def get_instrument(plan, state):
     """Return a random Instrument for a Channel"""
 
     note = ""
     volume = ""
     offset = ""
-    nextSA = channel.currentSA
-    instrument = get_random_child(channel.instruments["local"],
-        globalDB["Instruments"], channel.instruments["useglobal"])
+    nextSA = state.currentSA
+    rng = state.rng
+    instrument = get_random_child(plan, plan.channels,
+        state.channel * compiled.CHANNEL_STRIDE + compiled.INSTRUMENTS, rng)
     instrument_map = list("0123456789:;<=>?@ABCDEFGHI")
 
     if instrument is not None:
-        note = get_octave(globalDB, instrument)
+        row = instrument * compiled.INSTRUMENT_STRIDE
+        note = get_octave(plan, row, rng)
         # since Octaves might not be defined, don't always
         # add Instrument data to note, so it'll be left blank
         if note:
-            number = instrument.number
+            number = plan.instruments[row + compiled.NUMBER]
             note += "%s%s" % (instrument_map[number / 10], number % 10)
-        volume = get_volume(globalDB, instrument)
-        temp = get_offset(globalDB, instrument)
+        volume = get_volume(plan, plan.instruments,
+            row + compiled.INSTRUMENT_VOLUMES, rng)
+        temp = get_offset(plan, row, rng)
         if temp:
             nextSA = temp[0]
             offset = temp[1]
@@ -76,98 +115,117 @@ def get_instrument(globalDB, channel):
     return (note, volume, offset), nextSA
 
 
-def get_octave(globalDB, instrument):
-    """Return a random Octave for an Instrument"""
-    octave = get_random_child(instrument.octaves["local"],
-            globalDB["Octaves"], instrument.octaves["useglobal"])
+def get_octave(plan, row, rng=random):
+    """Return a random Octave for the Instrument at row"""
+    octave = get_random_child(plan, plan.instruments,
+        row + compiled.OCTAVES, rng)
     if octave is None:
         return ""
     else:
-        pitch = random.randint(0, len(octave.pitches) - 1)
-        return "%s%s" % (octave.pitches[pitch], octave.number)
+        start, count = plan.octaves[octave * compiled.OCTAVE_STRIDE:
+            (octave + 1) * compiled.OCTAVE_STRIDE]
+        pitch = (start + rng.randint(0, count - 1)) * compiled.PITCH_WIDTH
+        return plan.pitches[pitch:pitch + compiled.PITCH_WIDTH]
+
 
+def format_letter(letter):
+    """Get the letter of a compiled Volume or Effect"""
+    return chr(letter) if letter else ""
 
-def get_effect(globalDB, channel):
+
+def get_effect(plan, state):
     """Return a random Effect for a Channel"""
-    effect = get_random_child(channel.effects["local"],
-        globalDB["Effects"], channel.effects["useglobal"])
+    effect = get_random_child(plan, plan.channels,
+        state.channel * compiled.CHANNEL_STRIDE + compiled.EFFECTS,
+        state.rng)
     if effect is None:
         return ""
     else:
-        value = "%X" % get_random_value(effect.valueRange)
-        return effect.effect + value.zfill(2)
+        row = effect * compiled.EFFECT_STRIDE
+        letter, low, high = plan.effects[row:row + compiled.EFFECT_STRIDE]
+        value = "%X" % state.rng.randint(low, high)
+        return format_letter(letter) + value.zfill(2)
 
 
-def get_volume(globalDB, source):
-    """Return a random Volume for a Channel or an Instrument"""
-    volume = get_random_child(source.volumes["local"],
-        globalDB["Volumes"], source.volumes["useglobal"])
+def get_volume(plan, table, field, rng=random):
+    """
+    Return a random Volume for a Channel or an Instrument, from the
+    candidates listed at field of its row in table
+    """
+    volume = get_random_child(plan, table, field, rng)
     if volume is None:
         return ""
     else:
-        value = str(get_random_value(volume.valueRange))
-        return volume.effect + value.zfill(2)
+        row = volume * compiled.EFFECT_STRIDE
+        letter, low, high = plan.volumes[row:row + compiled.EFFECT_STRIDE]
+        value = str(rng.randint(low, high))
+        return format_letter(letter) + value.zfill(2)
 
 
-def get_offset(globalDB, instrument):
+def get_offset(plan, row, rng=random):
     """
-    Return a random Sample Area and Offset Value for an Instrument
+    Return a random Sample Area and Offset Value for the Instrument at row
     If none can be found, returns None
     """
-    offset = get_random_child(instrument.offsets["local"],
-        globalDB["Offsets"], instrument.offsets["useglobal"])
+    offset = get_random_child(plan, plan.instruments,
+        row + compiled.OFFSETS, rng)
     if offset is None:
         return None
     else:
-        return format_offset(offset)
+        row = offset * compiled.OFFSET_STRIDE
+        return format_offset(plan.offsets[row:row + compiled.OFFSET_STRIDE],
+            rng)
 
 
-def format_offset(offset):
-    """Format an Offset"""
+def format_offset(offset, rng=random):
+    """
+    Format an Offset
+    offset holds its low and high values, then its low and high Sample Areas
+    """
 
     nextSA = 0
     low = 0
     high = 255
-
-    nextSA = get_random_value(offset.sampleArea)
-    if nextSA == offset.sampleArea[0]:
-        low = offset.valueRange[0]
-    if nextSA == offset.sampleArea[1]:
-        high = offset.valueRange[1]
-    roll = get_random_value((low, high))
+    valueRange, sampleArea = offset[0:2], offset[2:4]
+
+    nextSA = get_random_value(sampleArea, rng)
+    if nextSA == sampleArea[0]:
+        low = valueRange[0]
+    if nextSA == sampleArea[1]:
+        high = valueRange[1]
+    roll = get_random_value((low, high), rng)
     value = "O" + ("%X" % roll).zfill(2)
 
     return nextSA, value
 
 
-def get_channel_line(database, channel):
+def get_channel_line(plan, state):
     """Generates a single line for a channel"""
 
     # if the channel is muted, keep it in place without overwriting anything
-    if channel.muted:
+    if state.muted:
         return "|" + " " * 11
 
-    space = "." if channel.overwrite else " "
+    space = "." if state.overwrite else " "
     note = ""
     volume = ""
     effect = ""
 
     # interrupts creating a line in favour of setting the
     # Sample Area for the channel correctly
-    if (channel.instruments["curSpacing"] == 1 and
-                channel.nextSA != channel.currentSA):
-        channel.currentSA = channel.nextSA
-        effect = "SA%X" % channel.nextSA
+    if state.spacing[0] == 1 and state.nextSA != state.currentSA:
+        state.currentSA = state.nextSA
+        effect = "SA%X" % state.nextSA
 
-    if tick_spacing(channel.instruments) and channel.nextInstrument != "":
-        note, volume, effect = channel.nextInstrument
-        channel.nextInstrument, channel.nextSA = get_instrument(
-            database["global"], channel)
+    if tick_spacing(plan, state, compiled.INSTRUMENTS):
+        note, volume, effect = state.nextInstrument
+        state.nextInstrument, state.nextSA = get_instrument(plan, state)
 
-    if not volume and tick_spacing(channel.volumes):
-        volume = get_volume(database["global"], channel)
-    if not effect and tick_spacing(channel.effects):
-        effect = get_effect(database["global"], channel)
+    if not volume and tick_spacing(plan, state, compiled.VOLUMES):
+        volume = get_volume(plan, plan.channels, state.channel *
+            compiled.CHANNEL_STRIDE + compiled.VOLUMES, state.rng)
+    if not effect and tick_spacing(plan, state, compiled.EFFECTS):
+        effect = get_effect(plan, state)
 
     line = "|"
     line += note or space * 5
@@ -176,36 +234,281 @@ def get_channel_line(database, channel):
     return line
 
 
-def init_channels(database):
-    """Initialize a list of Channels to produce"""
-
-    channels = []
-
-    if len(database["root"]["Channels"]) > 127:
-        print("There are too many Channels available, OpenMPT only allows "
-            "up to 127. Channels after 127 will be ignored.")
+def get_channel_cells(plan, state, count):
+    """
+    Generate the next count lines for a channel, as a list of its cells
+    Rows where every spacing is still counting down draw nothing and are
+    always blank, so each run of them is copied from a single blank cell
+    """
+    if state.muted:
+        return ["|" + " " * 11] * count
+    blank = "|" + ("." if state.overwrite else " ") * 11
+    cells = []
+    # tick_spacing changes this list in place, so it stays up to date
+    spacing = state.spacing
+    while len(cells) < count:
+        run = min(spacing[0], spacing[1], spacing[2], count - len(cells))
+        # the row before an Instrument may set the Sample Area instead
+        if state.nextSA != state.currentSA:
+            run = min(run, spacing[0] - 1)
+        if run > 0:
+            cells.extend(itertools.repeat(blank, run))
+            spacing[0] -= run
+            spacing[1] -= run
+            spacing[2] -= run
+        else:
+            cells.append(get_channel_line(plan, state))
+    return cells
+
+
+def channel_seed(seed, index):
+    """
+    Derive the seed for the Channel at index from a production seed
+    Every Channel gets its own stream, so its output never depends
+    on which other Channels are produced alongside it
+    """
+    return int(hashlib.md5("%s:%s" % (seed, index)).hexdigest(), 16)
 
-    for channel in database["root"]["Channels"][:127]:
-        channels.append(channel)
-        channel.reset()
-        channel.nextInstrument, channel.nextSA = get_instrument(
-            database["global"], channel)
-        for child in (channel.instruments, channel.volumes, channel.effects):
-            tick_spacing(child)
 
-    return channels
+def prepare_channel(plan, channel, rng):
+    """
+    Make the state of the Channel at row channel of plan,
+    drawing from the seeded rng so it's ready for production
+    """
+    state = compiled.ChannelState(plan, channel, rng)
+    state.nextInstrument, state.nextSA = get_instrument(plan, state)
+    for field in (compiled.INSTRUMENTS, compiled.VOLUMES, compiled.EFFECTS):
+        tick_spacing(plan, state, field)
+    return state
 
 
-def output(database, filename, channels, lines):
-    """Generate and output a tracker song""" 
-    with open(filename, 'w') as outfile:
-        # header required for OpenMPT to parse file
-        outfile.write("ModPlug Tracker  IT\n")
+def init_channels(plan, seed, first=0, count=MAX_CHANNELS, model=None,
+                rng="mersenne"):
+    """
+    Initialize the states of up to count Channels of plan to produce,
+    starting from the Channel at position first
+    If model is given, the Channels are readied for the Markov engine
+    rng names the kind of random number generator in RNGS to seed them with
+    """
+    states = []
+    for index in xrange(first, min(first + count, plan.channel_count())):
+        generator = RNGS[rng](channel_seed(seed, index))
+        if model is None:
+            states.append(prepare_channel(plan, index, generator))
+        else:
+            state = compiled.ChannelState(plan, index, generator)
+            markov.prepare_channel(model, state, index)
+            states.append(state)
+    return states
+
+
+def generate_rows(plan, states, lines, model=None, columnRows=COLUMN_ROWS):
+    """
+    Lazily generate lines rows of tracker notes for the Channel states,
+    from model with the Markov engine if it's given
+    Without it, columnRows rows of every Channel are held at a time
+    """
+    if model is not None:
         for _ in xrange(lines):
             line = ""
-            for channel in channels:
-                line += get_channel_line(database, channel)
-            outfile.write(line + "\n")
+            for state in states:
+                line += markov.get_channel_line(model, state)
+            yield line
+        return
+    # each Channel draws from its own rng, so they can be generated one
+    # column of rows at a time without changing what they draw
+    for start in xrange(0, lines, columnRows):
+        count = min(columnRows, lines - start)
+        if not states:
+            for _ in xrange(count):
+                yield ""
+            continue
+        columns = [get_channel_cells(plan, state, count) for state in states]
+        for line in itertools.imap("".join, itertools.izip(*columns)):
+            yield line
+
+
+def write_rows(outfile, rows, rowBlock=DEFAULT_TUNING[1],
+            queueDepth=DEFAULT_TUNING[2]):
+    """
+    Write rows to outfile in blocks of rowBlock rows, handing them to a
+    writer thread so generating the next block overlaps writing the last
+    At most queueDepth blocks wait to be written at once
+    """
+    blocks = Queue.Queue(queueDepth)
+    failed = []
+
+    def writer():
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            # keeps taking blocks after a failure, so nothing waits forever
+            if not failed:
+                try:
+                    outfile.write(block)
+                except Exception as error:
+                    failed.append(error)
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        while not failed:
+            block = list(itertools.islice(rows, rowBlock))
+            if not block:
+                break
+            blocks.put("\n".join(block) + "\n")
+    finally:
+        blocks.put(None)
+        thread.join()
+    if failed:
+        raise failed[0]
+
+
+def output(plan, filename, states, lines, model=None, tuning=DEFAULT_TUNING):
+    """
+    Generate and output a tracker song
+    tuning is a tuple of (RNG backend, row block size, queue depth)
+    """
+    with sinks.open_sink(filename) as outfile:
+        outfile.write(HEADER)
+        write_rows(outfile, generate_rows(plan, states, lines, model,
+            tuning[1]), tuning[1], tuning[2])
+
+
+def pattern_filename(filename, number):
+    """Get the name of a numbered pattern file derived from filename"""
+    root, ext = sinks.split_name(filename)
+    return "%s_p%03d%s" % (root, number, ext)
+
+
+def output_patterns(plan, filename, states, lines, patternRows,
+                    model=None, tuning=DEFAULT_TUNING):
+    """
+    Generate a tracker song split into patterns of patternRows rows,
+    each written to its own paste-ready file
+    Channels keep their spacing and Sample Area state between patterns,
+    so the patterns play back exactly like one continuous song
+    Return a list of the pattern filenames
+    """
+    rows = generate_rows(plan, states, lines, model, tuning[1])
+    filenames = []
+    for number in xrange((lines + patternRows - 1) // patternRows):
+        patternFile = pattern_filename(filename, number)
+        with sinks.open_sink(patternFile) as outfile:
+            outfile.write(HEADER)
+            write_rows(outfile, itertools.islice(rows, patternRows),
+                tuning[1], tuning[2])
+        filenames.append(patternFile)
+    return filenames
+
+
+def get_shards(total, size=MAX_CHANNELS):
+    """Split total Channels into a list of (first, count) groups"""
+    return [(first, min(size, total - first))
+            for first in xrange(0, total, size)]
+
+
+def shard_filename(filename, number):
+    """Get the name of a numbered shard file derived from filename"""
+    root, ext = sinks.split_name(filename)
+    return "%s_%03d%s" % (root, number, ext)
+
+
+def planned_files(filename, total, lines, patternRows=0, shard=True):
+    """
+    Get the name of every file output_shards would write for total
+    Channels, ending with the index file
+    """
+    shards = get_shards(total)
+    if not shard:
+        shards = shards[:1]
+    planned = []
+    for number in xrange(len(shards)):
+        shardFile = shard_filename(filename, number) if shard else filename
+        if patternRows:
+            planned += [pattern_filename(shardFile, pattern) for pattern in
+                        xrange((lines + patternRows - 1) // patternRows)]
+        else:
+            planned.append(shardFile)
+    return planned + [sinks.split_name(filename)[0] + ".index"]
+
+
+def init_worker(plan, model):
+    """Give a pool worker the shared Plan and Model to render from"""
+    global workerPlan, workerModel
+    workerPlan, workerModel = plan, model
+
+
+def render_shard(job):
+    """
+    Produce one shard into its own file, meant to be run by a worker
+    job is a tuple of (plan, filename, first, count, seed, lines,
+    patternRows, model, tuning), and if patternRows is set the shard is
+    split into pattern files as well
+    If plan is None, the worker's shared Plan and Model are used instead
+    Return a list of the files written
+    """
+    (plan, filename, first, count, seed, lines, patternRows, model,
+        tuning) = job
+    if plan is None:
+        plan, model = workerPlan, workerModel
+    states = init_channels(plan, seed, first, count, model, tuning[0])
+    if patternRows:
+        return output_patterns(plan, filename, states,
+            lines, patternRows, model, tuning)
+    output(plan, filename, states, lines, model, tuning)
+    return [filename]
+
+
+def output_shards(plan, filename, seed, lines, workers=0,
+                patternRows=0, shard=True, model=None,
+                tuning=DEFAULT_TUNING):
+    """
+    Produce Channels by splitting them into groups OpenMPT can hold,
+    rendering each group (and each of its patterns, if patternRows is set)
+    to its own file in parallel, and writing an index file describing
+    how the files line up
+    If shard is False, only the first group of Channels is produced
+    Return a list of every file written, ending with the index file
+    """
+    shards = get_shards(plan.channel_count())
+    if not shard:
+        shards = shards[:1]
+    workers = min(cfg.worker_count(workers), len(shards))
+    jobs = []
+    for number, (first, count) in enumerate(shards):
+        shardFile = shard_filename(filename, number) if shard else filename
+        # workers read the shared Plan, so it isn't pickled into every job
+        if workers > 1:
+            jobs.append((None, shardFile, first, count, seed,
+                lines, patternRows, None, tuning))
+        else:
+            jobs.append((plan, shardFile, first, count, seed,
+                lines, patternRows, model, tuning))
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, init_worker,
+            (compiled.share(plan), model))
+        try:
+            written = pool.map(render_shard, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        written = [render_shard(job) for job in jobs]
+
+    index = {"seed": seed, "lines": lines, "patternRows": patternRows,
+        "shards": []}
+    for filenames, (first, count) in zip(written, shards):
+        index["shards"].append({"firstChannel": first, "channels": count,
+            "patterns": filenames})
+    indexName = sinks.split_name(filename)[0] + ".index"
+    with open(indexName, 'w') as indexFile:
+        json.dump(index, indexFile, indent=2, sort_keys=True)
+    print("Wrote %s files described by \"%s\"." % (
+        sum(len(filenames) for filenames in written), indexName))
+    return sum(written, []) + [indexName]
 
 
 def get_lines_wanted(configLines):
@@ -222,18 +525,175 @@ def get_lines_wanted(configLines):
     return lines
 
 
-def produce(database, config):
-    """Produce a tracker song from a given database"""
+def get_model(configTraining):
+    """
+    Train a Markov model on the pattern files named in the config file,
+    or on files the user enters if there aren't any
+    Return None if no model could be trained
+    """
+    if configTraining:
+        patterns = configTraining.split()
+        print("Training the Markov engine on %s from the config file." %
+            configTraining)
+    else:
+        prompt = ("Enter the names of the pattern files to train the Markov "
+            "engine on, separated by spaces. Wildcards like *.txt are "
+            "allowed.")
+        patterns = ui.get_input(prompt, "preserve").split()
+
+    filenames = []
+    for pattern in patterns:
+        filenames += sorted(glob.glob(pattern))
+    model = markov.train(filenames)
+    if model is None:
+        print("\nNo pattern files to train the Markov engine on.")
+    else:
+        print(model)
+    return model
+
+
+def get_tuning(config, channels, workers):
+    """
+    Get the (RNG backend, row block size, queue depth) to produce with,
+    shrinking the blocks until every worker's buffered rows fit together
+    under the config's memory ceiling
+    """
+    rowBlock, queueDepth = config["rowblock"], config["queuedepth"]
+    rowBytes = channels * importer.CELL_WIDTH + 1
+    # a worker holds its waiting blocks, plus one being written, one being
+    # joined into lines, and the Channel columns that one is joined from
+    buffered = lambda: workers * (queueDepth + 3) * rowBlock * rowBytes
+    ceiling = config["memory"] * 1024 * 1024
+    while buffered() > ceiling and (queueDepth > 1 or rowBlock > 1):
+        if queueDepth > 1:
+            queueDepth //= 2
+        else:
+            rowBlock //= 2
+    if (rowBlock, queueDepth) != (config["rowblock"], config["queuedepth"]):
+        print("Writing blocks of %s rows, %s at a time, to stay under %s MB."
+            % (rowBlock, queueDepth, config["memory"]))
+    return config["rng"], rowBlock, queueDepth
 
-    filePrompt = "Enter the name of a file to write the tracker notes to."
-    filename = ui.get_filename(filePrompt, 'w',
-        config["filename"], config["overwrite"])
-    if filename is None:
-        return None
 
+def produce(database, config):
+    """
+    Produce a tracker song from a given database
+    If the config file names an output directory, every production is
+    given its own numbered file there instead of asking for a filename
+    """
+
+    outputDir = config["outputdir"]
+    if not outputDir:
+        filePrompt = "Enter the name of a file to write the tracker notes to."
+        filename = ui.get_filename(filePrompt, 'w',
+            config["filename"], config["overwrite"])
+        if not filename:
+            return None
+
+    total = len(database["root"]["Channels"])
+    shard = False
+    if total > MAX_CHANNELS:
+        prompt = ("There are %s Channels, but OpenMPT only allows up to %s. "
+            "Split them across %s shard files? Y/N" % (
+                total, MAX_CHANNELS, len(get_shards(total))))
+        shard = ui.get_binary_choice(prompt)
+        if not shard:
+            print("Channels after %s will be ignored." % MAX_CHANNELS)
+
+    model = None
+    if config["engine"] == "markov":
+        model = get_model(config["training"])
+        if model is None:
+            return None
+
+    plan = compiled.cache.get(database)
+    channels = min(plan.channel_count(), MAX_CHANNELS)
+    workers = 1
+    if shard or config["patternrows"]:
+        workers = min(cfg.worker_count(config["workers"]),
+            len(get_shards(total)) if shard else 1)
+    tuning = get_tuning(config, channels, workers)
+    # the Plan doesn't change between repeats, so it's only hashed once
+    digest = None
+    if config["cache"]["size"] and not (shard or config["patternrows"]):
+        digest = compiled.plan_digest(plan)
     repeat = True
     while repeat:
-        channels = init_channels(database)
+        seed = config["seed"]
+        if seed is None:
+            seed = random.randint(0, 2 ** 32 - 1)
+        print("Producing with seed %s." % seed)
         lines = get_lines_wanted(config["lines"])
-        output(database, filename, channels, lines)
-        repeat = ui.get_binary_choice("Repeat? Y/N")
\ No newline at end of file
+        if outputDir:
+            filename = outputs.allocate(outputDir, config["filename"])
+        written = [filename]
+        if shard or config["patternrows"]:
+            if not ui.verify_filenames(planned_files(filename, total, lines,
+                    config["patternrows"], shard), config["overwrite"]):
+                return None
+            written = output_shards(plan, filename, seed, lines,
+                workers, config["patternrows"], shard, model, tuning)
+        else:
+            key = None
+            if digest is not None:
+                key = rendercache.make_key(digest, seed, lines,
+                    config["engine"], config["rng"], model,
+                    sinks.compression(filename))
+            if key is None or not rendercache.fetch(config["cache"], key,
+                                                    filename):
+                states = init_channels(plan, seed, model=model,
+                    rng=config["rng"])
+                output(plan, filename, states, lines, model, tuning)
+                if key is not None:
+                    rendercache.store(config["cache"], key, filename)
+        if outputDir:
+            for path in written:
+                outputs.get_manager(outputDir).record(path)
+        repeat = ui.get_binary_choice("Repeat? Y/N")
+
+
+def color_cell(cell):
+    """Colour the note, volume, and effect of a single Channel's cell"""
+    parts = (cell[1:6], cell[6:9], cell[9:12])
+    colored = "|"
+    for part, color in zip(parts, PREVIEW_COLORS):
+        if part.strip(" ."):
+            colored += color + part + PREVIEW_RESET
+        else:
+            colored += part
+    return colored
+
+
+def show_rows(rows, channels, color=False):
+    """Print rows of tracker notes under aligned Channel headings"""
+    width = importer.CELL_WIDTH
+    print("".join(("|Channel %s" % number).ljust(width)
+                  for number in xrange(1, channels + 1)))
+    for line in rows:
+        if color:
+            line = "".join(color_cell(line[start:start + width])
+                           for start in xrange(0, len(line), width))
+        print(line)
+
+
+def preview(database, config, rows=PREVIEW_ROWS, color=False):
+    """
+    Print the first rows of a production to the terminal, generating
+    only those rows and writing nothing to disk
+    """
+    model = None
+    if config["engine"] == "markov":
+        model = get_model(config["training"])
+        if model is None:
+            return None
+    seed = config["seed"]
+    if seed is None:
+        seed = random.randint(0, 2 ** 32 - 1)
+
+    plan = compiled.cache.get(database)
+    states = init_channels(plan, seed, model=model, rng=config["rng"])
+    if not states:
+        print("\nThere are no Channels to preview.")
+        return None
+    print("\nPreviewing %s rows with seed %s." % (rows, seed))
+    show_rows(generate_rows(plan, states, rows, model), len(states), color)
@@ -5,8 +5,38 @@ from __future__ import print_function
 """Handles all non-arg user input"""
 
 import os
+import collections
 
 INFINITY = float("inf")
+# how many options a multiple choice prompt shows at once
+PAGE_LENGTH = 10
+# answers queued up by a script, which replace the terminal while it runs
+scripted = None
+# what a comment line in a script starts with
+COMMENT = "##"
+
+
+def load_script(lines):
+    """
+    Queue up lines to answer every prompt instead of the terminal
+    Lines starting with ## are comments and are skipped, as a single #
+    is a valid answer, like the # Effect Type
+    """
+    global scripted
+    scripted = collections.deque(line.rstrip("\r\n") for line in lines
+                                if not line.startswith(COMMENT))
+
+
+def read_line(prompt):
+    """
+    Read a raw line for a prompt, from the script if one is loaded
+    Raise an EOFError once a script runs out of lines
+    """
+    if scripted is None:
+        return raw_input("\n" + prompt + "\n")
+    if not scripted:
+        raise EOFError("The script ran out of lines.")
+    return scripted.popleft()
 
 
 def get_input(prompt, case="upper"):
@@ -15,7 +45,7 @@ def get_input(prompt, case="upper"):
     case can be upper (default), lower, title, or preserve
     Raise a ValueError if case is incorrect, to prevent unexpected bugs
     """
-    response = raw_input("\n" + prompt + "\n").strip()
+    response = read_line(prompt).strip()
     if case == "upper":
         return response.upper()
     elif case == "lower":
@@ -52,49 +82,143 @@ def get_binary_choice(prompt, valid=["Y", "N", "YES", "NO", ""], wanted="Y"):
         return get_input(prompt).startswith(wanted)
 
 
-def get_mult_choice(prompt, valid, options, exit):
+def match_filter(option, key, value):
+    """
+    Check if an option matches a filter, which can be for its type,
+    its Effect or Volume letter, or its number
+    """
+    if key == "type":
+        return type(option).__name__.lower().startswith(value)
+    elif key == "letter":
+        return str(getattr(option, "effect", "")).lower() == value
+    elif key == "number":
+        return str(getattr(option, "number", "")) == value
+    return False
+
+
+def parse_selection(entry, options):
+    """
+    Parse an entry picking out options by comma or space separated
+    numbers (5), ranges (1-500), all, or filters (type=volume, letter=v,
+    number=3), any of which can have a ! in front to leave them out
+    Return sets of the indexes to add and remove, or None if it's invalid
+    """
+    add = set()
+    remove = set()
+    for term in entry.replace(",", " ").split():
+        chosen = add
+        if term.startswith("!"):
+            chosen = remove
+            term = term[1:]
+        if term == "all":
+            chosen.update(xrange(len(options)))
+        elif "=" in term:
+            key, value = term.split("=", 1)
+            if key not in ("type", "letter", "number"):
+                print("\nYou can only filter by type, letter, or number.")
+                return None
+            chosen.update(n for n, option in enumerate(options)
+                        if match_filter(option, key, value))
+        else:
+            low, dash, high = term.partition("-")
+            if not low.isdigit() or (dash and not high.isdigit()):
+                print("\nYou entered \"%s\" which is not a valid option."
+                    % term)
+                return None
+            low = int(low)
+            high = int(high) if dash else low
+            if not 1 <= low <= high <= len(options):
+                print("\nYou entered \"%s\" but options only go from "
+                    "1 to %s." % (term, len(options)))
+                return None
+            chosen.update(xrange(low - 1, high))
+    return add, remove
+
+
+def show_page(prompt, options, page, chosen=None):
+    """
+    Make a prompt showing one page of numbered options,
+    marking the chosen ones if chosen is a set of indexes
     """
-    Prompt the user and let them keep toggling
-    various valid options until they enter the exit char
+    pages = (len(options) + PAGE_LENGTH - 1) // PAGE_LENGTH
+    prompt += "\nPage %s/%s" % (page + 1, pages)
+    if chosen is not None:
+        prompt += ", %s of %s chosen" % (len(chosen), len(options))
+    prompt += "."
+    for n in xrange(page * PAGE_LENGTH,
+                    min((page + 1) * PAGE_LENGTH, len(options))):
+        mark = ""
+        if chosen is not None:
+            mark = "* " if n in chosen else "  "
+        prompt += "\n%s%s) %s" % (mark, n + 1, options[n])
+    return prompt
+
+
+def turn_page(entry, page, options):
+    """Return the page to move to if entry is N or P, otherwise None"""
+    last = (len(options) - 1) // PAGE_LENGTH
+    if entry == "n":
+        return min(page + 1, last)
+    elif entry == "p":
+        return max(page - 1, 0)
+    return None
+
+
+def get_mult_choice(prompt, options, chosen, exit):
     """
-    valid.append(exit)
-    c = get_choice(prompt, valid)
-    status = ""
-    while c != exit:
-        # toggle the chosen option
-        options[c] = not options[c]
-        status = "on" if options[c] else "off"
-        print("Option %s is now %s." % (c, status))
-        c = get_choice(prompt, valid)
+    Prompt the user with pages of options and let them keep choosing
+    and unchoosing options until they enter the exit char
+    chosen is the set of indexes of the options chosen so far
+    """
+    instructions = ("Enter numbers, ranges like 1-5, all, or filters like "
+        "type=volume, letter=v or number=3 to choose them, with ! in front "
+        "to unchoose them. N and P change pages, and %s continues." % exit)
+    page = 0
+    while True:
+        entry = get_input(show_page(prompt, options, page, chosen) +
+            "\n" + instructions, "lower")
+        if entry == exit.lower():
+            return chosen
+        newPage = turn_page(entry, page, options)
+        if newPage is not None:
+            page = newPage
+            continue
+        selection = parse_selection(entry, options)
+        if selection is not None:
+            chosen |= selection[0]
+            chosen -= selection[1]
 
 
 def make_mult_choice(prompt, options, exit="", default=False, single=False):
     """
-    Wrapper for making a multiple choice prompt from a generic list
-    Defaults to using get_mult_choice and returns all True items, 
-    but if single is True, it will use get_choice and return only one
+    Wrapper for making a paged multiple choice prompt from a generic list
+    Defaults to using get_mult_choice and returns all chosen items,
+    but if single is True, it will return only one
+    Return None (or an empty list) if there are no options
     """
 
-    bools = {}
-    valid = []
-    for n, option in enumerate(options, 1):
-        prompt += "\n%s) %s" % (n, option)
-        n = str(n)
-        bools[n] = default
-        valid.append(n)
+    if not options:
+        print("\nThere is nothing to choose from.")
+        return None if single else []
 
     if single:
-        chosen = get_choice(prompt, valid)
-        # enumerate gave an offset of 1
-        return options[int(chosen) - 1]
+        page = 0
+        while True:
+            entry = get_input(show_page(prompt, options, page) +
+                "\nEnter a number, or N and P to change pages.", "lower")
+            newPage = turn_page(entry, page, options)
+            if newPage is not None:
+                page = newPage
+            elif entry.isdigit() and 1 <= int(entry) <= len(options):
+                # options are shown starting from 1
+                return options[int(entry) - 1]
+            else:
+                print("\nYou entered \"%s\" which is not a valid option."
+                    % entry)
     else:
-        get_mult_choice(prompt, valid, bools, exit)
-        chosen = []
-        for i, status in bools.items():
-            if status:
-                # enumerate gave an offset of 1
-                chosen.append(options[int(i) - 1])
-        return chosen
+        chosen = set(xrange(len(options))) if default else set()
+        chosen = get_mult_choice(prompt, options, chosen, exit)
+        return [options[n] for n in sorted(chosen)]
 
 
 def convert_to_int(value, getHex=False):
@@ -187,7 +311,7 @@ def verify_filename(filename, mode, overwrite):
 
     againPrompt = "Pick a different file? Y/N"
     existsPrompt = "File %s already exists. Overwrite? Y/N"
-    found = filename in os.listdir(".")
+    found = os.path.isfile(filename)
 
     if mode == 'r' and not found:
         # if found:
@@ -212,6 +336,25 @@ def verify_filename(filename, mode, overwrite):
     return filename
 
 
+def verify_filenames(filenames, overwrite):
+    """
+    Check a group of files that are about to be written, asking before
+    overwriting any that already exist
+    Return True if they can all be written, and False otherwise
+    """
+    found = [filename for filename in filenames if os.path.isfile(filename)]
+    if not found:
+        return True
+    elif overwrite:
+        print("\nAutomatically overwriting %s existing files." % len(found))
+        return True
+    prompt = "%s of these files already exist, like %s. Overwrite them? Y/N"
+    if get_binary_choice(prompt % (len(found), found[0])):
+        print("\nOverwriting %s files." % len(found))
+        return True
+    return False
+
+
 def get_filename(prompt, mode, filename="", overwrite=False):
     """
     Prompt the user to choose a file to read or write to
@@ -226,6 +369,6 @@ def get_filename(prompt, mode, filename="", overwrite=False):
         # user declined to try again in verify_filename
         if filename is None:
             return ""
-        filename = raw_input("\n" + prompt + "\n").strip()
+        filename = read_line(prompt).strip()
         filename = verify_filename(filename, mode, overwrite)
     return filename
\ No newline at end of file
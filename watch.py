@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+"""
+Watches a saved database file, and re-renders a tracker song whenever it
+changes, patching over only the Channels that would come out different
+"""
+
+import os
+import mmap
+import time
+import pickle
+import random
+
+import sinks
+import tracker
+import compiled
+import importer
+import userinput as ui
+
+# seconds between checks of the database file
+POLL_INTERVAL = 1.0
+
+
+def load_file(filename):
+    """
+    Return the database saved in filename, or None if it can't be read,
+    like when it's only partly written
+    """
+    try:
+        with open(filename, 'r') as infile:
+            return pickle.load(infile)
+    except Exception as error:
+        print("\nCould not load \"%s\" yet. %s" % (filename, error))
+        return None
+
+
+def expected_size(channels, lines):
+    """Get the size of a render of channels Channels and lines rows"""
+    return len(tracker.HEADER) + lines * (channels * importer.CELL_WIDTH + 1)
+
+
+def patch_channels(plan, filename, seed, lines, changed, total, model=None,
+                tuning=tracker.DEFAULT_TUNING):
+    """
+    Render only the Channels at the positions in changed, writing their
+    cells over the same columns of an existing render of total Channels
+    """
+    states = []
+    for index in changed:
+        states += tracker.init_channels(plan, seed, index, 1, model,
+            tuning[0])
+    width = importer.CELL_WIDTH
+    rowWidth = total * width + 1
+    with open(filename, 'r+b') as outfile:
+        mapped = mmap.mmap(outfile.fileno(), 0)
+        try:
+            rows = tracker.generate_rows(plan, states, lines, model,
+                tuning[1])
+            for row, line in enumerate(rows):
+                start = len(tracker.HEADER) + row * rowWidth
+                for column, index in enumerate(changed):
+                    cell = start + index * width
+                    mapped[cell:cell + width] = line[
+                        column * width:(column + 1) * width]
+        finally:
+            mapped.close()
+
+
+def rerender(database, filename, seed, lines, digests, model=None,
+            tuning=tracker.DEFAULT_TUNING):
+    """
+    Render the Channels of database whose digests changed since the last
+    render into filename, or all of them if that render can't be patched
+    tuning is a tuple of (RNG backend, row block size, queue depth)
+    Return the new digests
+    """
+    channels = database["root"]["Channels"][:tracker.MAX_CHANNELS]
+    current = [compiled.channel_digest(database, channel)
+               for channel in channels]
+    plan = compiled.compile_database(database)
+
+    # compressed renders can't be patched in place
+    if (digests is None or len(digests) != len(current) or
+            sinks.compression(filename) or
+            not os.path.isfile(filename) or os.path.getsize(filename) !=
+            expected_size(len(current), lines)):
+        states = tracker.init_channels(plan, seed, model=model,
+            rng=tuning[0])
+        tracker.output(plan, filename, states, lines, model, tuning)
+        print("\nRendered all %s Channels to \"%s\"." % (
+            len(current), filename))
+        return current
+
+    changed = [index for index, digest in enumerate(current)
+               if digest != digests[index]]
+    if changed:
+        patch_channels(plan, filename, seed, lines, changed,
+            len(current), model, tuning)
+        print("\nRe-rendered %s of %s Channels." % (len(changed),
+            len(current)))
+    else:
+        print("\nNo Channels changed.")
+    return current
+
+
+def watch(dbConfig, config):
+    """
+    Re-render a tracker song from a database file every time it's saved,
+    until the user presses Ctrl+C
+    Every render uses the same seed, so unchanged Channels stay the same
+    """
+    prompt = "Enter the name of the database file to watch."
+    dbFile = ui.get_filename(prompt, 'r', dbConfig["save"])
+    if not dbFile:
+        return None
+    prompt = "Enter the name of a file to write the tracker notes to."
+    filename = ui.get_filename(prompt, 'w',
+        config["filename"], config["overwrite"])
+    if not filename:
+        return None
+
+    model = None
+    if config["engine"] == "markov":
+        model = tracker.get_model(config["training"])
+        if model is None:
+            return None
+    seed = config["seed"]
+    if seed is None:
+        seed = random.randint(0, 2 ** 32 - 1)
+    lines = tracker.get_lines_wanted(config["lines"])
+    tuning = tracker.get_tuning(config, tracker.MAX_CHANNELS, 1)
+
+    print("\nWatching \"%s\" with seed %s. Press Ctrl+C to stop." % (
+        dbFile, seed))
+    digests = None
+    modified = None
+    try:
+        while True:
+            if os.path.isfile(dbFile):
+                mtime = os.stat(dbFile).st_mtime
+                if mtime != modified:
+                    database = load_file(dbFile)
+                    # a file that can't be loaded yet is tried again later
+                    if database is not None:
+                        modified = mtime
+                        digests = rerender(database, filename, seed,
+                            lines, digests, model, tuning)
+            time.sleep(POLL_INTERVAL)
+    except KeyboardInterrupt:
+        print("\nStopped watching \"%s\"." % dbFile)